@@ -23,21 +23,41 @@
 # SOFTWARE.
 # =============================================================================
 
+import atexit
+import configparser
+import contextvars
 import csv
+import gzip
+import hashlib
 import io
 import json
 import os
+import queue
+import re
 import secrets
 import string
 import shutil
+import socket
+import sqlite3
+import sys
+import threading
 import time
 
-from datetime import timedelta
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
 
-import click
-import snowflake.connector
+from bisect import bisect_right
+from collections import OrderedDict, deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, as_completed, wait
+from contextlib import ExitStack, contextmanager
+from functools import lru_cache
+from datetime import datetime, timedelta, timezone
+from itertools import chain, islice
 
-from tabulate import tabulate
+import click
 
 IP_BLOCKLIST = [
     "104.223.91.28",
@@ -344,30 +364,624 @@ CLIENT_ENVIRONMENT_BLOCKLIST = [
 ]
 
 
-def connect():
+# Snowflake error codes that mean a pooled connection can no longer be used and
+# has to be replaced by a fresh login (master token expired/invalid, connection
+# closed, session renewal failed).
+RECONNECT_ERRNOS = {390114, 390115, 250002, 252007}
+
+
+def load_env():
     if os.path.exists(".env"):
         from dotenv import load_dotenv
 
         load_dotenv()
-    return snowflake.connector.connect(
-        account=os.environ["SNOWFLAKE_ACCOUNT"],
-        user=os.environ["SNOWFLAKE_USER"],
-        password=os.environ["SNOWFLAKE_PASSWORD"],
-        role=os.environ.get("SNOWFLAKE_ROLE"),
-        warehouse=os.environ.get("SNOWFLAKE_WAREHOUSE"),
+
+
+_profiles = {}
+_current_account = contextvars.ContextVar("account", default=None)
+
+
+def load_profiles(path):
+    parser = configparser.ConfigParser(interpolation=None)
+    with open(path) as f:
+        parser.read_file(f)
+    for name in parser.sections():
+        _profiles[name] = dict(parser[name])
+    return parser.sections()
+
+
+def connection_params(account=None):
+    load_env()
+    if account is None:
+        params = dict(
+            account=os.environ["SNOWFLAKE_ACCOUNT"],
+            user=os.environ["SNOWFLAKE_USER"],
+            role=os.environ.get("SNOWFLAKE_ROLE"),
+            warehouse=os.environ.get("SNOWFLAKE_WAREHOUSE"),
+        )
+        if os.environ.get("SNOWFLAKE_PRIVATE_KEY_FILE"):
+            params["private_key_file"] = os.environ["SNOWFLAKE_PRIVATE_KEY_FILE"]
+            params["private_key_file_pwd"] = os.environ.get(
+                "SNOWFLAKE_PRIVATE_KEY_FILE_PWD"
+            )
+        else:
+            params["password"] = os.environ["SNOWFLAKE_PASSWORD"]
+        return params
+    # Profile keys ending in _env name an environment variable holding the
+    # value, so secrets can stay out of the profiles file.
+    params = {}
+    for key, value in _profiles[account].items():
+        if key.endswith("_env"):
+            params[key[: -len("_env")]] = os.environ[value]
+        else:
+            params[key] = value
+    return params
+
+
+class Metrics:
+    def __init__(self, max_samples=10_000):
+        self.max_samples = max_samples
+        self.measure_payload = False
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def record(self, name, seconds, rows=None, bytes=None):
+        with self._lock:
+            call = self._calls.get(name)
+            if call is None:
+                call = self._calls[name] = {
+                    "count": 0,
+                    "seconds": 0.0,
+                    "max": 0.0,
+                    "rows": 0,
+                    "bytes": 0,
+                    "samples": deque(maxlen=self.max_samples),
+                }
+            call["count"] += 1
+            call["seconds"] += seconds
+            call["max"] = max(call["max"], seconds)
+            call["rows"] += rows or 0
+            call["bytes"] += bytes or 0
+            call["samples"].append(seconds)
+
+    def snapshot(self):
+        with self._lock:
+            calls = {name: dict(call) for name, call in self._calls.items()}
+            for call in calls.values():
+                call["samples"] = sorted(call["samples"])
+        result = {}
+        for name, call in sorted(calls.items()):
+            samples = call.pop("samples")
+            for quantile in (0.5, 0.95, 0.99):
+                index = min(int(len(samples) * quantile), len(samples) - 1)
+                call[f"p{int(quantile * 100)}"] = samples[index]
+            result[name] = call
+        return result
+
+    def summary(self):
+        rows = [
+            [
+                name,
+                call["count"],
+                f"{call['seconds']:.3f}",
+                *(f"{call[p] * 1000:.1f}" for p in ("p50", "p95", "p99")),
+                f"{call['max'] * 1000:.1f}",
+                call["rows"],
+                call["bytes"],
+            ]
+            for name, call in self.snapshot().items()
+        ]
+        return tabulate(
+            rows,
+            headers=["Call", "Count", "Total s", "p50 ms", "p95 ms", "p99 ms"]
+            + ["Max ms", "Rows", "Bytes"],
+        )
+
+    def openmetrics(self):
+        lines = [
+            "# TYPE titan_call_seconds summary",
+            "# UNIT titan_call_seconds seconds",
+        ]
+        calls = self.snapshot()
+        for name, call in calls.items():
+            for quantile in ("0.5", "0.95", "0.99"):
+                p = f"p{int(float(quantile) * 100)}"
+                lines.append(
+                    f'titan_call_seconds{{call="{name}",quantile="{quantile}"}} {call[p]}'
+                )
+            lines.append(f'titan_call_seconds_count{{call="{name}"}} {call["count"]}')
+            lines.append(f'titan_call_seconds_sum{{call="{name}"}} {call["seconds"]}')
+        for metric in ("rows", "bytes"):
+            lines.append(f"# TYPE titan_call_{metric} counter")
+            for name, call in calls.items():
+                lines.append(
+                    f'titan_call_{metric}_total{{call="{name}"}} {call[metric]}'
+                )
+        lines.append("# EOF")
+        return "\n".join(lines) + "\n"
+
+
+_metrics = Metrics()
+_metrics_file = None
+_metrics_interval = 15.0
+_metrics_exported_at = 0
+
+
+@contextmanager
+def timed(name):
+    sample = {}
+    started = time.perf_counter()
+    try:
+        yield sample
+    finally:
+        _metrics.record(name, time.perf_counter() - started, **sample)
+
+
+def export_metrics(force=False):
+    global _metrics_exported_at
+    if not _metrics_file:
+        return
+    now = time.monotonic()
+    if not force and now - _metrics_exported_at < _metrics_interval:
+        return
+    _metrics_exported_at = now
+    if _metrics_file.endswith(".json"):
+        write_json_atomic(_metrics_file, _metrics.snapshot())
+        return
+    tmp = f"{_metrics_file}.{os.getpid()}.tmp"
+    with open(tmp, "w") as f:
+        f.write(_metrics.openmetrics())
+    os.replace(tmp, _metrics_file)
+
+
+def start_profiler():
+    # TITAN_PROFILE=cprofile|pyinstrument profiles the whole command; the
+    # report goes to stderr, or TITAN_PROFILE_OUTPUT for cProfile stats.
+    mode = os.environ.get("TITAN_PROFILE", "").lower()
+    if mode == "cprofile":
+        import cProfile
+        import pstats
+
+        profiler = cProfile.Profile()
+        profiler.enable()
+
+        def stop():
+            profiler.disable()
+            output = os.environ.get("TITAN_PROFILE_OUTPUT")
+            if output:
+                profiler.dump_stats(output)
+            else:
+                pstats.Stats(profiler, stream=sys.stderr).sort_stats(
+                    "cumulative"
+                ).print_stats(30)
+
+        return stop
+    if mode == "pyinstrument":
+        from pyinstrument import Profiler
+
+        profiler = Profiler()
+        profiler.start()
+
+        def stop():
+            profiler.stop()
+            sys.stderr.write(profiler.output_text(unicode=True))
+
+        return stop
+    if mode:
+        raise click.BadParameter(
+            f"Unknown TITAN_PROFILE {mode!r}, expected cprofile or pyinstrument"
+        )
+    return None
+
+
+class SessionCache:
+    # Session and master tokens of sessions left open by earlier runs, keyed
+    # by account/user/role. The tokens are bearer credentials, so the file is
+    # only readable by the owner.
+    def __init__(self, path, max_sessions=16, margin=300):
+        self.path = path
+        self.max_sessions = max_sessions
+        self.margin = margin
+        self._lock = threading.Lock()
+
+    def _load(self):
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    @contextmanager
+    def _locked(self):
+        # The thread lock covers this process; the lock file covers other
+        # runs reading and rewriting the cache at the same time.
+        with self._lock:
+            fd = os.open(f"{self.path}.lock", os.O_RDWR | os.O_CREAT, 0o600)
+            try:
+                if fcntl is not None:
+                    fcntl.flock(fd, fcntl.LOCK_EX)
+                else:
+                    msvcrt.locking(fd, msvcrt.LK_LOCK, 1)
+                try:
+                    yield
+                finally:
+                    if fcntl is None:
+                        msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+            finally:
+                os.close(fd)
+
+    def checkout(self, key):
+        # Taking the entry out of the file keeps two processes from sharing
+        # (and renewing) the same session.
+        with self._locked():
+            data = self._load()
+            entries = [
+                entry
+                for entry in data.get(key, [])
+                if entry["expires_at"] - self.margin > time.time()
+            ]
+            entry = entries.pop() if entries else None
+            data[key] = entries
+            write_json_atomic(self.path, data)
+            return entry
+
+    def checkin(self, key, conn, expires_at):
+        # Returns the live entries pushed out by max_sessions; the caller has
+        # to log them out, or they stay open on the server until they expire.
+        with self._locked():
+            data = self._load()
+            entries = [
+                entry
+                for entry in data.get(key, [])
+                if entry["session_token"] != conn.rest.token
+                and entry["expires_at"] > time.time()
+            ]
+            entries.append(
+                {
+                    "session_token": conn.rest.token,
+                    "master_token": conn.rest.master_token,
+                    "master_validity": conn.rest.master_validity_in_seconds,
+                    "expires_at": expires_at,
+                }
+            )
+            evicted = entries[: -self.max_sessions]
+            data[key] = entries[-self.max_sessions :]
+            write_json_atomic(self.path, data)
+            return evicted
+
+
+_session_cache = None
+_session_cache_enabled = None
+_session_cache_lock = threading.Lock()
+
+
+def get_session_cache():
+    global _session_cache
+    enabled = _session_cache_enabled
+    if enabled is None:
+        load_env()
+        enabled = os.environ.get("TITAN_SESSION_CACHE", "1") not in ("0", "false")
+    if not enabled:
+        return None
+    with _session_cache_lock:
+        if _session_cache is None:
+            _session_cache = SessionCache(state_path("sessions.json"))
+        return _session_cache
+
+
+def session_cache_key(params):
+    return "/".join(
+        str(params.get(k) or "") for k in ("account", "user", "role", "warehouse")
     )
 
 
-def execute(sql):
-    with connect() as conn:
-        with conn.cursor(snowflake.connector.DictCursor) as cur:
-            return cur.execute(sql).fetchall()
+def connect(account=None):
+    params = connection_params(account)
+    cache = get_session_cache()
+    if cache is None:
+        with timed("connect"):
+            return snowflake_connector().connect(**params)
+    # Sessions are kept alive on the server when closed so their tokens can
+    # be resumed by the next run; the connector renews the session token
+    # with the master token until the master token itself expires.
+    key = session_cache_key(params)
+    params["server_session_keep_alive"] = True
+    while True:
+        entry = cache.checkout(key)
+        if entry is None:
+            break
+        try:
+            with timed("resume"):
+                conn = snowflake_connector().connect(
+                    **params,
+                    session_token=entry["session_token"],
+                    master_token=entry["master_token"],
+                    master_validity_in_seconds=entry["master_validity"],
+                )
+        except snowflake_connector().errors.Error:
+            continue
+        conn.titan_session = (key, entry["expires_at"], account)
+        return conn
+    with timed("connect"):
+        conn = snowflake_connector().connect(**params)
+    conn.titan_session = (
+        key,
+        time.time() + conn.rest.master_validity_in_seconds,
+        account,
+    )
+    return conn
+
+
+def logout(conn):
+    # close() skips the logout for keep-alive sessions, so anything that is
+    # not handed back to the session cache is closed through here.
+    conn._server_session_keep_alive = False
+    try:
+        conn.close()
+    except Exception:
+        pass
+
+
+def logout_cached_session(account, entry):
+    try:
+        conn = snowflake_connector().connect(
+            **connection_params(account),
+            session_token=entry["session_token"],
+            master_token=entry["master_token"],
+            master_validity_in_seconds=entry["master_validity"],
+        )
+    except snowflake_connector().errors.Error:
+        # Already expired or logged out.
+        return
+    logout(conn)
+
+
+def release_connection(conn):
+    # Hand a healthy session back to the cache instead of logging it out.
+    cache = get_session_cache()
+    session = getattr(conn, "titan_session", None)
+    if cache is None or session is None or conn.is_closed():
+        logout(conn)
+        return
+    key, expires_at, account = session
+    try:
+        evicted = cache.checkin(key, conn, expires_at)
+    except Exception:
+        logout(conn)
+        return
+    conn.close()
+    for entry in evicted:
+        logout_cached_session(account, entry)
+
+
+@contextmanager
+def account_scope(account):
+    if account is None:
+        yield
+        return
+    token = _current_account.set(account)
+    try:
+        yield
+    finally:
+        _current_account.reset(token)
+
+
+class ConnectionPool:
+    def __init__(self, size=4, health_check_interval=60, connect=connect, release=None):
+        self.size = size
+        self.health_check_interval = health_check_interval
+        self._connect = connect
+        self._release = release
+        self._slots = threading.BoundedSemaphore(size)
+        self._lock = threading.Lock()
+        self._idle = []
+        self._closed = False
+
+    def _is_healthy(self, conn, idle_since):
+        if conn.is_closed() or getattr(conn, "expired", False):
+            return False
+        if time.monotonic() - idle_since > self.health_check_interval:
+            return conn.is_valid()
+        return True
+
+    def _checkout(self):
+        while True:
+            with self._lock:
+                if not self._idle:
+                    break
+                conn, idle_since = self._idle.pop()
+            if self._is_healthy(conn, idle_since):
+                return conn
+            self._discard(conn)
+        return self._connect()
+
+    def _discard(self, conn):
+        logout(conn)
+
+    @contextmanager
+    def connection(self):
+        if self._closed:
+            raise RuntimeError("Connection pool is closed")
+        self._slots.acquire()
+        conn = None
+        try:
+            conn = self._checkout()
+            yield conn
+        except snowflake_connector().errors.Error as err:
+            if conn is not None and err.errno in RECONNECT_ERRNOS:
+                self._discard(conn)
+                conn = None
+            raise
+        finally:
+            if conn is not None:
+                if self._closed or conn.is_closed():
+                    self._discard(conn)
+                else:
+                    with self._lock:
+                        self._idle.append((conn, time.monotonic()))
+            self._slots.release()
+
+    def close(self):
+        self._closed = True
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn, _ in idle:
+            if self._release is None:
+                self._discard(conn)
+                continue
+            try:
+                self._release(conn)
+            except Exception:
+                pass
+
+
+_pools = {}
+_pool_size = None
+_pool_lock = threading.Lock()
+
+
+def _new_pool(account=None):
+    load_env()
+    pool = ConnectionPool(
+        size=_pool_size or int(os.environ.get("SNOWFLAKE_POOL_SIZE", 4)),
+        health_check_interval=float(
+            os.environ.get("SNOWFLAKE_POOL_HEALTH_CHECK_INTERVAL", 60)
+        ),
+        connect=lambda: connect(account),
+        release=release_connection,
+    )
+    atexit.register(pool.close)
+    return pool
+
+
+def get_pool():
+    account = _current_account.get() or _default_account
+    with _pool_lock:
+        if account not in _pools:
+            _pools[account] = _new_pool(account)
+        return _pools[account]
+
+
+def configure_pool(size):
+    global _pool_size
+    with _pool_lock:
+        _pool_size = size
+        for pool in _pools.values():
+            pool.close()
+        _pools.clear()
+
+
+def ensure_pool_size(size):
+    if get_pool().size < size:
+        configure_pool(size)
+
+
+_accounts = [None]
+_default_account = None
+_account_concurrency = 8
+
+
+def require_single_account(what):
+    # Rather than quietly running against the first selected profile.
+    if len(_accounts) > 1:
+        raise click.UsageError(f"{what} requires a single --account")
+
+
+def for_each_account(fn):
+    if _accounts == [None]:
+        return fn()
+
+    def run(account):
+        with account_scope(account):
+            return [dict(row, account=account) for row in fn()]
+
+    rows = []
+    with ThreadPoolExecutor(
+        max_workers=min(_account_concurrency, len(_accounts))
+    ) as executor:
+        futures = [executor.submit(run, account) for account in _accounts]
+        for account, future in zip(_accounts, futures):
+            try:
+                rows.extend(future.result())
+            except Exception as err:
+                click.echo(f"[{account}] {err}", err=True)
+    return rows
+
+
+def fetch_sessions():
+    return for_each_account(get_sessions)
+
+
+def fetch_users():
+    return for_each_account(get_cached_users)
+
+
+def fetch_user(name):
+    return for_each_account(lambda: find_user(name))
+
+
+def needs_reconnect(err):
+    return (
+        isinstance(err, snowflake_connector().errors.Error)
+        and err.errno in RECONNECT_ERRNOS
+    )
+
+
+def execute(sql, params=None):
+    # A pooled session can expire underneath us, so retry once on a fresh login.
+    for attempt in range(2):
+        try:
+            with get_pool().connection() as conn:
+                with conn.cursor(snowflake_connector().DictCursor) as cur:
+                    with timed("execute"):
+                        cur.execute(sql, params)
+                    with timed("fetch") as sample:
+                        rows = cur.fetchall()
+                        sample["rows"] = len(rows)
+                    return rows
+        except snowflake_connector().errors.Error as err:
+            if attempt or not needs_reconnect(err):
+                raise
+
+
+def execute_multi(sql, num_statements):
+    with get_pool().connection() as conn:
+        with conn.cursor(snowflake_connector().DictCursor) as cur:
+            with timed("execute"):
+                cur.execute(sql, num_statements=num_statements)
+            with timed("fetch") as sample:
+                results = [cur.fetchall()]
+                while cur.nextset():
+                    results.append(cur.fetchall())
+                sample["rows"] = sum(len(rows) for rows in results)
+            return results
+
+
+# snowflake.connector and tabulate are imported on first use to keep startup
+# fast for commands that never need them.
+def snowflake_connector():
+    import snowflake.connector
+
+    return snowflake.connector
+
+
+def tabulate(*args, **kwargs):
+    from tabulate import tabulate
+
+    return tabulate(*args, **kwargs)
 
 
 def clear_terminal():
     os.system("cls" if os.name == "nt" else "clear")
 
 
+def redraw(text):
+    # Move the cursor home and overwrite in place instead of clearing the
+    # screen, which avoids flicker on frequent updates.
+    sys.stdout.write("\x1b[H" + text.replace("\n", "\x1b[K\n") + "\x1b[K\x1b[J\n")
+    sys.stdout.flush()
+
+
 def trunc(s, max_length=16):
     return s if len(s) <= max_length else s[:max_length] + "..."
 
@@ -400,58 +1014,691 @@ def time_ago(timestamp):
     return "just now"
 
 
-def session_client_environment_matches_blocklist(client_environment):
-    environment = json.loads(client_environment)
-    for rule in CLIENT_ENVIRONMENT_BLOCKLIST:
-        if all(environment.get(k) == v for k, v in rule.items()):
+def parse_ip(address):
+    for version, family in ((4, socket.AF_INET), (6, socket.AF_INET6)):
+        try:
+            return version, int.from_bytes(socket.inet_pton(family, address), "big")
+        except (OSError, TypeError):
+            pass
+    raise ValueError(f"Invalid IP address: {address!r}")
+
+
+class IPMatcher:
+    def __init__(self, indicators=()):
+        self._exact = set()
+        ranges = {4: [], 6: []}
+        for indicator in indicators:
+            self._add(indicator.strip(), ranges)
+        self._starts = {}
+        self._ends = {}
+        for version, intervals in ranges.items():
+            merged = []
+            for start, end in sorted(intervals):
+                if merged and start <= merged[-1][1] + 1:
+                    merged[-1][1] = max(merged[-1][1], end)
+                else:
+                    merged.append([start, end])
+            if merged:
+                self._starts[version] = [start for start, _ in merged]
+                self._ends[version] = [end for _, end in merged]
+
+    def _add(self, indicator, ranges):
+        if "-" in indicator:
+            first, last = indicator.split("-", 1)
+            version, start = parse_ip(first.strip())
+            _, end = parse_ip(last.strip())
+            ranges[version].append((start, end))
+        elif "/" in indicator:
+            address, prefix = indicator.split("/", 1)
+            version, value = parse_ip(address.strip())
+            host_bits = (32 if version == 4 else 128) - int(prefix)
+            start = value >> host_bits << host_bits
+            ranges[version].append((start, start | ((1 << host_bits) - 1)))
+        else:
+            version, value = parse_ip(indicator)
+            if version == 4:
+                self._exact.add(indicator)
+            else:
+                # IPv6 has many textual forms, so match it numerically.
+                ranges[version].append((value, value))
+
+    def __contains__(self, address):
+        if address in self._exact:
             return True
-    return False
+        if not self._starts:
+            return False
+        try:
+            version, value = parse_ip(address)
+        except ValueError:
+            return False
+        starts = self._starts.get(version)
+        if not starts:
+            return False
+        i = bisect_right(starts, value) - 1
+        return i >= 0 and value <= self._ends[version][i]
+
+    def __len__(self):
+        return len(self._exact) + sum(len(starts) for starts in self._starts.values())
+
+    def ranges(self):
+        for address in sorted(self._exact, key=parse_ip):
+            version, value = parse_ip(address)
+            yield version, value, value
+        for version, starts in self._starts.items():
+            yield from zip([version] * len(starts), starts, self._ends[version])
+
+
+def read_indicators(path):
+    with open(path) as f:
+        for line in f:
+            line = line.split("#", 1)[0].strip()
+            if line:
+                yield line
+
+
+_ip_matcher = None
+_ip_blocklist_paths = []
+_blocklist_generation = 0
+
+
+def bump_blocklist_generation():
+    # Lets holders of cached verdicts (SessionWatcher) notice that the IP or
+    # client environment blocklists were replaced and re-score.
+    global _blocklist_generation
+    _blocklist_generation += 1
+
+
+def blocklist_generation():
+    get_ip_matcher()
+    get_client_environment_rules()
+    return _blocklist_generation
+
+
+def load_ip_blocklist(paths=None, extra=()):
+    # Builds a new matcher and swaps it in with a single assignment, so
+    # lookups running in other threads never see a half-built matcher.
+    global _ip_matcher, _ip_blocklist_paths
+    load_env()
+    if paths is not None:
+        _ip_blocklist_paths = list(paths)
+    paths = list(_ip_blocklist_paths)
+    if os.environ.get("TITAN_IP_BLOCKLIST"):
+        paths += os.environ["TITAN_IP_BLOCKLIST"].split(os.pathsep)
+    indicators = list(IP_BLOCKLIST)
+    for path in paths:
+        indicators.extend(read_indicators(path))
+    indicators.extend(extra)
+    _ip_matcher = IPMatcher(indicators)
+    bump_blocklist_generation()
+    return _ip_matcher
+
+
+def get_ip_matcher():
+    if _ip_matcher is None:
+        return load_ip_blocklist()
+    return _ip_matcher
+
+
+def ip_is_blocklisted(address):
+    return address in get_ip_matcher()
+
+
+def parse_version(version):
+    return tuple(int(part) for part in re.findall(r"\d+", str(version)))
+
+
+def compile_condition(expected):
+    if not isinstance(expected, dict):
+        return lambda value: value == expected
+    if "prefix" in expected:
+        prefix = expected["prefix"]
+        return lambda value: isinstance(value, str) and value.startswith(prefix)
+    if "regex" in expected:
+        pattern = re.compile(expected["regex"])
+        return lambda value: isinstance(value, str) and bool(pattern.search(value))
+    if "min_version" in expected or "max_version" in expected:
+        low = parse_version(expected.get("min_version", ""))
+        high = expected.get("max_version")
+        high = parse_version(high) if high is not None else None
+        return lambda value: value is not None and (
+            low <= parse_version(value)
+            and (high is None or parse_version(value) < high)
+        )
+    raise ValueError(f"Unsupported client environment condition: {expected!r}")
+
+
+class ClientEnvironmentRules:
+    def __init__(self, rules=(), index_key="APPLICATION"):
+        self.index_key = index_key
+        self._indexed = {}
+        self._unindexed = []
+        for rule in rules:
+            conditions = [(k, compile_condition(v)) for k, v in rule.items()]
+            expected = rule.get(index_key)
+            if isinstance(expected, str):
+                self._indexed.setdefault(expected, []).append(conditions)
+            else:
+                self._unindexed.append(conditions)
+
+    def matches(self, environment):
+        key = environment.get(self.index_key)
+        candidates = self._indexed.get(key, []) if isinstance(key, str) else []
+        for conditions in chain(candidates, self._unindexed):
+            if all(condition(environment.get(k)) for k, condition in conditions):
+                return True
+        return False
+
+    def __len__(self):
+        return sum(map(len, self._indexed.values())) + len(self._unindexed)
+
+    def indexed_values(self):
+        # None when some rule can match any value of the index key.
+        return None if self._unindexed else set(self._indexed)
+
+
+@lru_cache(maxsize=65536)
+def parse_client_environment(client_environment):
+    try:
+        environment = json.loads(client_environment)
+    except (TypeError, ValueError):
+        return {}
+    return environment if isinstance(environment, dict) else {}
+
+
+_client_environment_rules = None
+
+
+def load_client_environment_rules(extra=()):
+    global _client_environment_rules
+    _client_environment_rules = ClientEnvironmentRules(
+        [*CLIENT_ENVIRONMENT_BLOCKLIST, *extra]
+    )
+    bump_blocklist_generation()
+    return _client_environment_rules
+
+
+def get_client_environment_rules():
+    if _client_environment_rules is None:
+        return load_client_environment_rules()
+    return _client_environment_rules
+
+
+STIX_ADDRESS_PATTERN = re.compile(r"(?:ipv4-addr|ipv6-addr):value\s*=\s*'([^']+)'")
+
+
+def parse_csv_feed(path, ips, rules):
+    with open(path, newline="") as f:
+        for row in csv.DictReader(f):
+            row = {k.strip().lower(): (v or "").strip() for k, v in row.items() if k}
+            value = row.get("indicator") or row.get("value") or row.get("ip")
+            kind = row.get("type", "ip").lower()
+            if not value:
+                continue
+            if kind in ("application", "client_application"):
+                rules.append({"APPLICATION": value})
+            else:
+                ips.append(value)
+
+
+def parse_json_feed(path, ips, rules):
+    with open(path) as f:
+        data = json.load(f)
+    objects = data.get("objects", []) if isinstance(data, dict) else data
+    for obj in objects:
+        if obj.get("revoked"):
+            continue
+        if obj.get("type") == "indicator":
+            ips.extend(STIX_ADDRESS_PATTERN.findall(obj.get("pattern", "")))
+        elif obj.get("type") == "x-client-environment-rule":
+            rules.append(obj["rule"])
+
+
+def read_feed_directory(directory):
+    ips, rules = [], []
+    for name in sorted(os.listdir(directory)):
+        path = os.path.join(directory, name)
+        extension = os.path.splitext(name)[1].lower()
+        if name.startswith(".") or not os.path.isfile(path):
+            continue
+        if extension == ".csv":
+            parse_csv_feed(path, ips, rules)
+        elif extension == ".json":
+            parse_json_feed(path, ips, rules)
+        elif extension in (".txt", ".list", ""):
+            ips.extend(read_indicators(path))
+    return ips, rules
+
+
+class ThreatFeed:
+    def __init__(self, directory, interval=30):
+        self.directory = directory
+        self.interval = interval
+        self.loaded_at = None
+        self._signature = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def signature(self):
+        entries = []
+        for name in sorted(os.listdir(self.directory)):
+            stat = os.stat(os.path.join(self.directory, name))
+            entries.append((name, stat.st_mtime_ns, stat.st_size))
+        return entries
+
+    def reload(self, signature=None):
+        signature = signature or self.signature()
+        if signature == self._signature:
+            return False
+        ips, rules = read_feed_directory(self.directory)
+        ip_matcher = load_ip_blocklist(extra=ips)
+        environment_rules = load_client_environment_rules(rules)
+        self._signature = signature
+        self.loaded_at = time.time()
+        print(
+            f"Loaded threat feed: {len(ip_matcher)} IP entries, "
+            f"{len(environment_rules)} client environment rules",
+            file=sys.stderr,
+        )
+        return True
+
+    def _run(self):
+        pending = None
+        while not self._stop.wait(self.interval):
+            try:
+                # Only reload once the files have stopped changing for an
+                # interval, so a feed that is still being written is skipped.
+                signature = self.signature()
+                if signature != pending:
+                    pending = signature
+                    continue
+                self.reload(signature)
+            except Exception as err:
+                # Keep serving the previous indicators if a feed is broken.
+                print(f"Failed to reload threat feed: {err}", file=sys.stderr)
+
+    def start(self):
+        self.reload()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+
+def session_client_environment_matches_blocklist(client_environment):
+    environment = parse_client_environment(client_environment)
+    return get_client_environment_rules().matches(environment)
 
 
 def session_is_suspicious(session):
-    if session["clientNetAddress"] in IP_BLOCKLIST:
+    if ip_is_blocklisted(session["clientNetAddress"]):
         return True
     if session_client_environment_matches_blocklist(session["clientEnvironment"]):
         return True
     return False
 
 
+class UserBaseline:
+    def __init__(self, max_users=50_000, max_values=32, min_observations=10):
+        self.max_users = max_users
+        self.max_values = max_values
+        self.min_observations = min_observations
+        self.profiles = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def features(session):
+        environment = parse_client_environment(session.get("clientEnvironment"))
+        return {
+            "ip": session.get("clientNetAddress"),
+            "application": session.get("clientApplication"),
+            "authn": session.get("authnMethod"),
+            "os": environment.get("OS"),
+        }
+
+    def observe(self, session):
+        # Compare the session with what has been seen for the user so far,
+        # then fold it into the profile. Users and their values are kept in
+        # LRU order and the least recently seen are evicted, so memory stays
+        # bounded by max_users * max_values.
+        key = (session.get("account"), session["userName"])
+        with self._lock:
+            profile = self.profiles.pop(key, None)
+            if profile is None:
+                profile = {"observations": 0}
+            self.profiles[key] = profile
+            if len(self.profiles) > self.max_users:
+                self.profiles.popitem(last=False)
+            anomalies = []
+            for name, value in self.features(session).items():
+                if value is None:
+                    continue
+                seen = profile.setdefault(name, OrderedDict())
+                if value in seen:
+                    seen.move_to_end(value)
+                else:
+                    if profile["observations"] >= self.min_observations:
+                        anomalies.append(f"new_{name}")
+                    seen[value] = True
+                    if len(seen) > self.max_values:
+                        seen.popitem(last=False)
+            profile["observations"] += 1
+            return anomalies
+
+
+# Risk score contributed by each detection. A session scoring at least
+# SUSPICIOUS_SCORE is treated as suspicious.
+SCORE_WEIGHTS = {
+    "blocklisted_ip": 1.0,
+    "blocklisted_client": 1.0,
+    "new_ip": 0.4,
+    "new_application": 0.3,
+    "new_authn": 0.3,
+    "new_os": 0.3,
+}
+SUSPICIOUS_SCORE = 1.0
+
+
+def factorize(values):
+    # Split a column into its distinct values and one code per row, so each
+    # detection runs once per distinct value rather than once per session.
+    try:
+        import pyarrow
+
+        encoded = pyarrow.array(values, type=pyarrow.string())
+        encoded = encoded.fill_null("").dictionary_encode()
+        return encoded.dictionary.to_pylist(), encoded.indices.to_numpy()
+    except (ImportError, TypeError, ValueError):
+        index = {}
+        codes = [index.setdefault(value, len(index)) for value in values]
+        return list(index), codes
+
+
+def column_hits(values, predicate):
+    uniques, codes = factorize(values)
+    hits = [predicate(value) for value in uniques]
+    try:
+        import numpy
+    except ImportError:
+        return [hits[code] for code in codes]
+    return numpy.asarray(hits, dtype=bool)[numpy.asarray(codes, dtype=numpy.intp)]
+
+
+def score_sessions(sessions, anomalies=None):
+    detections = {
+        "blocklisted_ip": column_hits(
+            [session["clientNetAddress"] for session in sessions], ip_is_blocklisted
+        ),
+        "blocklisted_client": column_hits(
+            [session["clientEnvironment"] for session in sessions],
+            session_client_environment_matches_blocklist,
+        ),
+    }
+    if anomalies is not None:
+        for name in ["new_ip", "new_application", "new_authn", "new_os"]:
+            detections[name] = [name in found for found in anomalies]
+    try:
+        import numpy
+    except ImportError:
+        scores = [
+            sum(SCORE_WEIGHTS[name] for name, hits in detections.items() if hits[i])
+            for i in range(len(sessions))
+        ]
+        reasons = [
+            [name for name, hits in detections.items() if hits[i]]
+            for i in range(len(sessions))
+        ]
+        return scores, reasons
+    scores = numpy.zeros(len(sessions))
+    reasons = [[] for _ in sessions]
+    for name, hits in detections.items():
+        hits = numpy.asarray(hits, dtype=bool)
+        scores += hits * SCORE_WEIGHTS[name]
+        for i in numpy.flatnonzero(hits):
+            reasons[i].append(name)
+    return scores, reasons
+
+
+def suspicious_sessions(sessions):
+    scores, _ = score_sessions(sessions)
+    return [
+        session for session, score in zip(sessions, scores) if score >= SUSPICIOUS_SCORE
+    ]
+
+
 def get_sessions() -> list[dict]:
-    conn = connect()
     url = "/monitoring/sessions"
-    response = conn.rest.request(
-        url=url,
-        method="get",
-        client="rest",
-    )
+    with get_pool().connection() as conn:
+        with timed("rest") as sample:
+            response = conn.rest.request(
+                url=url,
+                method="get",
+                client="rest",
+            )
+            if response["success"]:
+                sample["rows"] = len(response["data"]["sessions"])
+            # The connector hands back parsed JSON, so the payload size has to
+            # be re-measured; only pay for it when metrics are being looked at.
+            if _metrics.measure_payload:
+                sample["bytes"] = len(json.dumps(response))
     if not response["success"]:
         raise Exception(response)
-    conn.close()
     return response["data"]["sessions"]
 
 
 def get_suspicious_users(users, sessions):
-    suspicious_users = [
-        session["userName"] for session in sessions if session_is_suspicious(session)
+    suspicious_users = {
+        (session.get("account"), session["userName"])
+        for session in suspicious_sessions(sessions)
+    }
+    return [
+        user
+        for user in users
+        if (user.get("account"), user["name"]) in suspicious_users
     ]
-    suspicious_users = list(set(suspicious_users))
-    return [user for user in users if user["name"] in suspicious_users]
 
 
-def get_inactive_users(users, inactive_days=90):
-    def is_inactive(user):
-        return (
-            user["last_success_login"] < time.time() - inactive_days * 24 * 60 * 60
-            or user["last_success_login"] is None
-        )
+def fetch_suspicious_users():
+    sessions = fetch_sessions()
+    users = fetch_users()
+    known = {(user.get("account"), user["name"]) for user in users}
+    missing = {
+        session.get("account")
+        for session in suspicious_sessions(sessions)
+        if (session.get("account"), session["userName"]) not in known
+    }
+    if missing:
+        # Attackers often create their own users, which a cached directory
+        # will not list until its TTL runs out, so refetch those accounts.
+        for account in missing:
+            with account_scope(account):
+                get_user_directory().invalidate()
+        users = fetch_users()
+    return get_suspicious_users(users, sessions)
+
+
+def is_inactive(user, inactive_days=90):
+    last_login = user["last_success_login"]
+    if last_login is None:
+        return True
+    return last_login.timestamp() < time.time() - inactive_days * 24 * 60 * 60
 
-    return [user for user in users if is_inactive(user)]
+
+def get_inactive_users(users, inactive_days=90):
+    return [user for user in users if is_inactive(user, inactive_days)]
+
+
+INACTIVE_USERS_FROM_RESULT_SCAN = """
+SELECT * FROM TABLE(RESULT_SCAN(LAST_QUERY_ID()))
+WHERE "last_success_login" IS NULL
+   OR "last_success_login" < DATEADD(day, -%(days)s, CURRENT_TIMESTAMP())
+"""
+
+INACTIVE_USERS_FROM_ACCOUNT_USAGE = """
+SELECT
+    name AS "name",
+    login_name AS "login_name",
+    display_name AS "display_name",
+    email AS "email",
+    disabled AS "disabled",
+    has_password AS "has_password",
+    has_rsa_public_key AS "has_rsa_public_key",
+    default_role AS "default_role",
+    owner AS "owner",
+    created_on AS "created_on",
+    last_success_login AS "last_success_login"
+FROM SNOWFLAKE.ACCOUNT_USAGE.USERS
+WHERE deleted_on IS NULL
+  AND (last_success_login IS NULL
+       OR last_success_login < DATEADD(day, -%(days)s, CURRENT_TIMESTAMP()))
+"""
+
+
+def iter_show_users(chunk_size=1000):
+    with get_pool().connection() as conn:
+        with conn.cursor(snowflake_connector().DictCursor) as cur:
+            with timed("execute"):
+                cur.execute("show users")
+            while True:
+                with timed("fetch") as sample:
+                    rows = cur.fetchmany(chunk_size)
+                    sample["rows"] = len(rows)
+                if not rows:
+                    break
+                yield from rows
+
+
+def query_inactive_users(inactive_days=90, source="result_scan"):
+    params = {"days": inactive_days}
+    if source == "result_scan":
+        # RESULT_SCAN has to run on the session that ran SHOW USERS.
+        with get_pool().connection() as conn:
+            with conn.cursor(snowflake_connector().DictCursor) as cur:
+                with timed("execute"):
+                    cur.execute("show users")
+                    cur.execute(INACTIVE_USERS_FROM_RESULT_SCAN, params)
+                with timed("fetch") as sample:
+                    rows = cur.fetchall()
+                    sample["rows"] = len(rows)
+                return rows
+    if source == "account_usage":
+        # ACCOUNT_USAGE lags behind by up to a couple of hours.
+        return execute(INACTIVE_USERS_FROM_ACCOUNT_USAGE, params)
+    return get_inactive_users(iter_show_users(), inactive_days)
+
+
+def fetch_inactive_users(inactive_days=90, source="result_scan"):
+    return for_each_account(lambda: query_inactive_users(inactive_days, source))
 
 
 def get_users() -> list[dict]:
     return execute("show users")
 
 
+def encode_datetime(value):
+    if isinstance(value, datetime):
+        return {"$datetime": value.isoformat()}
+    raise TypeError(f"Cannot serialize {type(value).__name__}")
+
+
+def decode_datetime(obj):
+    if "$datetime" in obj:
+        return datetime.fromisoformat(obj["$datetime"])
+    return obj
+
+
+class UserDirectory:
+    def __init__(self, path=None, ttl=300, fetch=get_users):
+        self.path = path
+        self.ttl = ttl
+        self.fetched_at = 0
+        self._fetch = fetch
+        self._by_name = {}
+        self._lock = threading.Lock()
+        if path and ttl > 0 and os.path.exists(path):
+            self._load()
+
+    def _load(self):
+        try:
+            with open(self.path) as f:
+                data = json.load(f, object_hook=decode_datetime)
+        except (OSError, ValueError):
+            return
+        self.fetched_at = data["fetched_at"]
+        self._by_name = {user["name"].lower(): user for user in data["users"]}
+
+    def _save(self):
+        if self.path:
+            write_json_atomic(
+                self.path,
+                {"fetched_at": self.fetched_at, "users": list(self._by_name.values())},
+                default=encode_datetime,
+            )
+
+    def _refresh(self):
+        self._by_name = {user["name"].lower(): user for user in self._fetch()}
+        self.fetched_at = time.time()
+        if self.ttl > 0:
+            self._save()
+
+    def _ensure_fresh(self):
+        # Returns whether the cached copy was used.
+        if self.ttl > 0 and time.time() - self.fetched_at < self.ttl:
+            return True
+        self._refresh()
+        return False
+
+    def users(self):
+        with self._lock:
+            self._ensure_fresh()
+            return list(self._by_name.values())
+
+    def get(self, name):
+        with self._lock:
+            cached = self._ensure_fresh()
+            user = self._by_name.get(name.lower())
+            if user is None and cached:
+                # The user may have been created since the cache was filled.
+                self._refresh()
+                user = self._by_name.get(name.lower())
+            return user
+
+    def invalidate(self):
+        with self._lock:
+            if self.fetched_at:
+                self.fetched_at = 0
+                self._save()
+
+
+_user_directories = {}
+_user_cache_ttl = None
+
+
+def get_user_directory():
+    account = _current_account.get() or _default_account
+    with _pool_lock:
+        if account not in _user_directories:
+            ttl = _user_cache_ttl
+            if ttl is None:
+                ttl = float(os.environ.get("TITAN_USER_CACHE_TTL", 300))
+            identifier = connection_params(account).get("account", account)
+            identifier = re.sub(r"[^\w.-]", "_", identifier)
+            _user_directories[account] = UserDirectory(
+                state_path(f"users-{identifier}.json"), ttl
+            )
+        return _user_directories[account]
+
+
+def get_cached_users():
+    return get_user_directory().users()
+
+
+def find_user(name):
+    user = get_user_directory().get(name)
+    return [user] if user else []
+
+
 def print_users(users, display_limit=None):
     if display_limit is None:
         terminal_lines = shutil.get_terminal_size((80, 20)).lines
@@ -465,48 +1712,441 @@ def print_users(users, display_limit=None):
         "has_password",
         "has_rsa_public_key",
     ]
+    if users and "account" in users[0]:
+        selected_columns.insert(0, "account")
     users = [[user[col] for col in selected_columns] for user in users]
     print(tabulate(users, headers=selected_columns))
 
 
+def disable_user_steps(user):
+    return [
+        (
+            f"Disabled user {user['name']}",
+            f"ALTER USER {user['name']} SET DISABLED = TRUE",
+        )
+    ]
+
+
+def user_label(user):
+    return f"{user['account']}/{user['name']}" if "account" in user else user["name"]
+
+
 def disable_user_account(user):
-    execute(f"ALTER USER {user['name']} SET DISABLED = TRUE")
+    with account_scope(user.get("account")):
+        for _, sql in disable_user_steps(user):
+            execute(sql)
+        get_user_directory().invalidate()
+
+
+def disable_users_batched(users, dry_run=False):
+    by_account = {}
+    for user in users:
+        by_account.setdefault(user.get("account"), []).extend(disable_user_steps(user))
+    for account, steps in by_account.items():
+        if account is not None:
+            print(f"-- {account}")
+        if dry_run:
+            print_batch(steps)
+            continue
+        with account_scope(account):
+            results = execute_batch(steps)
+            get_user_directory().invalidate()
+        for description, err in results:
+            print(f"Failed: {description}: {err}" if err else description)
+
+
+DELEGATED_AUTHORIZATIONS = ["NUMERACY", "SNOWSCOPE", "APPLICA", "CLEANROOM"]
+
+
+class IntegrationCatalog:
+    def __init__(self, ttl=3600, fetch=None):
+        self.ttl = ttl
+        self.fetched_at = 0
+        self._fetch = fetch or (lambda: execute("SHOW SECURITY INTEGRATIONS"))
+        self._lock = threading.Lock()
+        self._names = None
+
+    def names(self):
+        with self._lock:
+            if self._names is None or time.time() - self.fetched_at > self.ttl:
+                self._names = [row["name"] for row in self._fetch()]
+                self.fetched_at = time.time()
+            return self._names
+
+
+_integration_catalogs = {}
+
+
+def get_integration_catalog():
+    account = _current_account.get() or _default_account
+    with _pool_lock:
+        if account not in _integration_catalogs:
+            _integration_catalogs[account] = IntegrationCatalog()
+        return _integration_catalogs[account]
+
+
+def abort_steps(user):
+    return [("Aborted all queries", f"ALTER USER {user['name']} ABORT ALL QUERIES")]
+
+
+def revocation_steps(user):
+    steps = []
+    for auth in DELEGATED_AUTHORIZATIONS:
+        steps.append(
+            (
+                f"Revoked delegated authorization {auth}",
+                f"SELECT SYSTEM$REMOVE_ALL_DELEGATED_AUTHORIZATIONS('{user['name']}', '{auth}')",
+            )
+        )
+    for name in get_integration_catalog().names():
+        steps.append(
+            (
+                f"Revoked security authorization {name}",
+                f"SELECT SYSTEM$REMOVE_ALL_DELEGATED_AUTHORIZATIONS('{user['name']}', '{name}')",
+            )
+        )
+    return steps
+
+
+def password_reset_steps(user):
+    return [
+        (
+            "Reset password",
+            f"ALTER USER {user['name']} SET PASSWORD = '{generate_password()}'",
+        ),
+        ("Reset RSA public key", f"ALTER USER {user['name']} UNSET RSA_PUBLIC_KEY"),
+        (
+            "Reset RSA public key 2",
+            f"ALTER USER {user['name']} UNSET RSA_PUBLIC_KEY_2",
+        ),
+    ]
+
+
+# Sessions are stopped before tokens are revoked, and tokens before the
+# password and keys are replaced, so a user cannot re-authenticate midway.
+RESET_STAGES = [
+    ("abort", abort_steps),
+    ("revoke", revocation_steps),
+    ("credentials", password_reset_steps),
+]
+
+
+def credential_reset_steps(user):
+    return [step for _, stage_steps in RESET_STAGES for step in stage_steps(user)]
 
 
 def reset_user_credentials(user):
-    print(f"Resetting credentials for {user['name']}")
-    execute(f"ALTER USER {user['name']} ABORT ALL QUERIES")
-    print(" » Aborted all queries")
-    authorizations = ["NUMERACY", "SNOWSCOPE", "APPLICA", "CLEANROOM"]
-    for auth in authorizations:
-        execute(
-            f"SELECT SYSTEM$REMOVE_ALL_DELEGATED_AUTHORIZATIONS('{user['name']}', '{auth}')"
+    print(f"Resetting credentials for {user_label(user)}")
+    with account_scope(user.get("account")):
+        for description, sql in credential_reset_steps(user):
+            execute(sql)
+            print(f" » {description}")
+        get_user_directory().invalidate()
+
+
+def is_transient_error(err):
+    return isinstance(
+        err,
+        (
+            snowflake_connector().errors.OperationalError,
+            snowflake_connector().errors.InterfaceError,
+        ),
+    ) or needs_reconnect(err)
+
+
+def execute_with_retry(sql, retries=2, backoff=0.5):
+    # Always at least one attempt, so a step can never "succeed" unrun.
+    retries = max(retries, 0)
+    for attempt in range(retries + 1):
+        try:
+            return execute(sql)
+        except Exception as err:
+            if attempt == retries or not is_transient_error(err):
+                raise
+            time.sleep(backoff * 2**attempt)
+
+
+def run_steps(steps, retries=2):
+    results = []
+    for description, sql in steps:
+        try:
+            execute_with_retry(sql, retries)
+            results.append((description, None))
+        except Exception as err:
+            results.append((description, err))
+    return results
+
+
+# Upper bound on statements sent in a single multi-statement request.
+BATCH_MAX_STATEMENTS = 100
+
+
+def compile_batch(steps):
+    return "".join(f"{sql};\n" for _, sql in steps)
+
+
+def redact(sql):
+    return re.sub(r"PASSWORD = '[^']*'", "PASSWORD = '********'", sql)
+
+
+def print_batch(steps):
+    print(redact(compile_batch(steps)))
+
+
+def execute_batch(steps, retries=2):
+    results = []
+    for i in range(0, len(steps), BATCH_MAX_STATEMENTS):
+        chunk = steps[i : i + BATCH_MAX_STATEMENTS]
+        try:
+            execute_multi(compile_batch(chunk), len(chunk))
+            results += [(description, None) for description, _ in chunk]
+        except Exception:
+            # Snowflake stops at the first failing statement without saying
+            # which one it was, so replay the chunk statement by statement to
+            # attribute the failure. Remediation statements are idempotent.
+            results += run_steps(chunk, retries)
+    return results
+
+
+def reset_user_credentials_tracked(user, retries=2, batch=False):
+    with account_scope(user.get("account")):
+        try:
+            steps = credential_reset_steps(user)
+        except Exception as err:
+            return [("Listed security integrations", err)]
+        results = (execute_batch if batch else run_steps)(steps, retries)
+        get_user_directory().invalidate()
+        return results
+
+
+def reset_users_concurrently(users, concurrency=8, retries=2, batch=False):
+    if batch:
+        results = {}
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            futures = {
+                executor.submit(
+                    reset_user_credentials_tracked, user, retries, batch
+                ): user
+                for user in users
+            }
+            for future in as_completed(futures):
+                name = user_label(futures[future])
+                results[name] = future.result()
+                failed = [description for description, err in results[name] if err]
+                status = f"{len(failed)} step(s) failed" if failed else "done"
+                print(f"[{len(results)}/{len(futures)}] Reset {name}: {status}")
+    else:
+        results = reset_users_staged(users, concurrency, retries)
+    print_reset_summary(results)
+    return results
+
+
+def run_user_step(user, sql, retries):
+    with account_scope(user.get("account")):
+        execute_with_retry(sql, retries)
+
+
+def reset_users_staged(users, concurrency=8, retries=2, progress_interval=1.0):
+    # Each stage fans out every (user, step) pair at once instead of walking
+    # users one at a time, so the user x integration revocation matrix is
+    # bounded by concurrency rather than by round trips per user.
+    results = {user_label(user): {} for user in users}
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for stage, stage_steps in RESET_STAGES:
+            futures = {}
+            for user in users:
+                label = user_label(user)
+                try:
+                    with account_scope(user.get("account")):
+                        steps = stage_steps(user)
+                except Exception as err:
+                    results[label][(stage, -1)] = ("Listed security integrations", err)
+                    continue
+                for i, (description, sql) in enumerate(steps):
+                    future = executor.submit(run_user_step, user, sql, retries)
+                    futures[future] = (label, (stage, i), description)
+            failed = 0
+            last_report = time.monotonic()
+            for done, future in enumerate(as_completed(futures), 1):
+                label, key, description = futures[future]
+                err = future.exception()
+                failed += err is not None
+                results[label][key] = (description, err)
+                if (
+                    done == len(futures)
+                    or time.monotonic() - last_report >= progress_interval
+                ):
+                    print(f"[{stage}] {done}/{len(futures)} steps, {failed} failed")
+                    last_report = time.monotonic()
+    for account in {user.get("account") for user in users}:
+        with account_scope(account):
+            get_user_directory().invalidate()
+    stage_order = {stage: i for i, (stage, _) in enumerate(RESET_STAGES)}
+    return {
+        label: [
+            steps[key]
+            for key in sorted(steps, key=lambda key: (stage_order[key[0]], key[1]))
+        ]
+        for label, steps in results.items()
+    }
+
+
+def print_reset_summary(results):
+    rows = []
+    for name, steps in sorted(results.items()):
+        failed = [(description, err) for description, err in steps if err]
+        rows.append(
+            [
+                name,
+                f"{len(steps) - len(failed)}/{len(steps)}",
+                "\n".join(
+                    f"{description}: {trunc(str(err), 60)}"
+                    for description, err in failed
+                ),
+            ]
         )
-        print(f" » Revoked delegated authorization {auth}")
-    for secint in execute("SHOW SECURITY INTEGRATIONS"):
-        execute(
-            f"SELECT SYSTEM$REMOVE_ALL_DELEGATED_AUTHORIZATIONS('{user['name']}', '{secint['name']}')"
+    print()
+    print(tabulate(rows, headers=["User", "Succeeded", "Failed steps"]))
+
+
+# Fields the verdict depends on. lastQueryId and friends change on every
+# query, so comparing whole payloads would re-score every busy session.
+WATCH_FINGERPRINT_FIELDS = [
+    "userName",
+    "clientEnvironment",
+    "clientApplication",
+    "clientNetAddress",
+    "authnMethod",
+]
+
+
+def watch_fingerprint(session):
+    return tuple(session.get(k) for k in WATCH_FINGERPRINT_FIELDS)
+
+
+class SessionWatcher:
+    def __init__(self, baseline=None):
+        self.baseline = baseline
+        self.sessions = {}
+        self.suspicious = {}
+        self.anomalies = {}
+        self.generation = None
+        self.primed = False
+
+    def update(self, sessions):
+        generation = blocklist_generation()
+        current = {}
+        changed = []
+        for session in sessions:
+            id = session["id"]
+            current[id] = session
+            previous = self.sessions.get(id)
+            if previous is None:
+                if self.baseline is not None:
+                    anomalies = self.baseline.observe(session)
+                    # Sessions already connected at startup only seed the
+                    # baseline: the order they are seen in says nothing
+                    # about which of them is new for the user.
+                    if self.primed:
+                        self.anomalies[id] = anomalies
+                changed.append(("added", session))
+            elif watch_fingerprint(previous) != watch_fingerprint(session):
+                changed.append(("changed", session))
+        if generation != self.generation:
+            # The blocklists were reloaded, so verdicts cached for sessions
+            # that are still connected may be stale: re-score all of them and
+            # report the ones whose verdict flipped.
+            self.generation = generation
+            kinds = {session["id"]: kind for kind, session in changed}
+            changed = [
+                (kinds.get(id, "rescored"), session) for id, session in current.items()
+            ]
+        events = []
+        scores, _ = score_sessions(
+            [session for _, session in changed],
+            [self.anomalies.get(session["id"], ()) for _, session in changed],
         )
-        print(f" » Revoked security authorization {secint['name']}")
-    execute(f"ALTER USER {user['name']} SET PASSWORD = '{generate_password()}'")
-    print(" » Reset password")
-    execute(f"ALTER USER {user['name']} UNSET RSA_PUBLIC_KEY")
-    print(" » Reset RSA public key")
-    execute(f"ALTER USER {user['name']} UNSET RSA_PUBLIC_KEY_2")
-    print(" » Reset RSA public key 2")
+        for (kind, session), score in zip(changed, scores):
+            id = session["id"]
+            suspicious = bool(score >= SUSPICIOUS_SCORE)
+            if kind == "rescored":
+                if suspicious == self.suspicious.get(id):
+                    continue
+                kind = "changed"
+            self.suspicious[id] = suspicious
+            events.append((kind, session, suspicious))
+        for id in self.sessions.keys() - current.keys():
+            self.anomalies.pop(id, None)
+            events.append(("removed", self.sessions[id], self.suspicious.pop(id)))
+        self.sessions = current
+        self.primed = True
+        return events
+
+    def suspicious_count(self):
+        return sum(self.suspicious.values())
+
+
+def format_event(kind, session, suspicious, anomalies=()):
+    marker = {"added": "+", "removed": "-", "changed": "~"}[kind]
+    flag = " ***" if suspicious else ""
+    if anomalies:
+        flag += f" !!! {', '.join(anomalies)}"
+    return (
+        f"{time.strftime('%H:%M:%S')} {marker} {session['userName']} "
+        f"{session['id']} {session['clientNetAddress']}{flag}"
+    )
 
 
-def watch_sessions(user=None, refresh_rate=0.5):
+def watch_sessions(
+    user=None,
+    min_interval=0.5,
+    max_interval=5.0,
+    event_lines=8,
+    history=None,
+    baseline=None,
+):
+    watcher = SessionWatcher(baseline)
+    log = deque(maxlen=event_lines)
+    interval = min_interval
+    table = ""
+    clear_terminal()
     while True:
         sessions = get_sessions()
+        if history:
+            history.record(sessions)
         if user:
             sessions = [s for s in sessions if s["userName"] == user]
-        clear_terminal()
-        print_sessions(sessions)
-        time.sleep(refresh_rate)
+        events = watcher.update(sessions)
+        for kind, session, suspicious in events:
+            anomalies = (
+                watcher.anomalies.get(session["id"], ()) if kind == "added" else ()
+            )
+            log.append(format_event(kind, session, suspicious, anomalies))
+        if events or not table:
+            terminal_lines = shutil.get_terminal_size((80, 20)).lines
+            table = format_sessions(
+                sessions, display_limit=max(terminal_lines - event_lines - 8, 1)
+            )
+        # Poll quickly while sessions are changing or anything suspicious is
+        # connected, and back off while the account is quiet.
+        if events or watcher.suspicious_count():
+            interval = min_interval
+        else:
+            interval = min(interval * 1.5, max_interval)
+        status = (
+            f"{len(sessions)} sessions, {watcher.suspicious_count()} suspicious, "
+            f"next poll in {interval:.1f}s"
+        )
+        redraw("\n".join([table, "", status, *log]))
+        export_metrics()
+        time.sleep(interval)
 
 
 def print_sessions(sessions, display_limit=None):
+    print(format_sessions(sessions, display_limit))
+
+
+def format_sessions(sessions, display_limit=None):
     if display_limit is None:
         terminal_lines = shutil.get_terminal_size((80, 20)).lines
         display_limit = terminal_lines - 5
@@ -527,86 +2167,991 @@ def print_sessions(sessions, display_limit=None):
         # "lastQueryId",
         # "clientBuildId",
     ]
+    if sessions and "account" in sessions[0]:
+        selected_columns.insert(0, "account")
 
     column_renderers = {
         "startTime": time_ago,
         "endTime": time_ago,
         "clientEnvironment": lambda x: (
-            f"*** {json.loads(x).get('APPLICATION', '')}"
+            f"*** {parse_client_environment(x).get('APPLICATION', '')}"
             if session_client_environment_matches_blocklist(x)
-            else json.loads(x).get("APPLICATION", "")
+            else parse_client_environment(x).get("APPLICATION", "")
         ),
-        "clientNetAddress": lambda x: f"*** {x}" if x in IP_BLOCKLIST else x,
+        "clientNetAddress": lambda x: f"*** {x}" if ip_is_blocklisted(x) else x,
     }
 
     header = selected_columns
+    total = len(sessions)
     sessions = [
         [column_renderers.get(col, lambda x: x)(row[col]) for col in selected_columns]
-        for row in sessions
+        for row in sessions[:display_limit]
     ]
-    if len(sessions) > display_limit:
-        total = len(sessions)
-        sessions = sessions[:display_limit]
+    if total > display_limit:
         sessions.append(["..."] * len(header))
         sessions.append(
             [f"And {total - display_limit} more"] + [""] * (len(header) - 1)
         )
-    print(tabulate(sessions, headers=header))
+    return tabulate(sessions, headers=header)
 
 
-def dump_sessions(sessions, format):
-    if format != "csv":
-        raise Exception("Only CSV format is supported")
-    if not sessions:
-        print("No data to print.")
+@contextmanager
+def open_output(path=None, compress=False):
+    compress = compress or (path is not None and path.endswith(".gz"))
+    if path is None and not compress:
+        yield sys.stdout
         return
-    headers = sessions[0].keys()
-    with io.StringIO() as output:
-        writer = csv.DictWriter(output, fieldnames=headers)
-        writer.writeheader()
-        writer.writerows(sessions)
-        print(output.getvalue())
+    if path is None:
+        raw = gzip.GzipFile(fileobj=sys.stdout.buffer, mode="wb")
+        output = io.TextIOWrapper(raw, encoding="utf-8", newline="")
+    elif compress:
+        output = gzip.open(path, "wt", encoding="utf-8", newline="")
+    else:
+        output = open(path, "w", encoding="utf-8", newline="")
+    try:
+        yield output
+    finally:
+        output.close()
+
+
+def csv_value(value):
+    if isinstance(value, (dict, list)):
+        return json.dumps(value)
+    return value
+
+
+def write_csv(rows, output):
+    rows = iter(rows)
+    first = next(rows, None)
+    if first is None:
+        return 0
+    # The header comes from the first row; keys that only show up in later
+    # rows are kept as a JSON object in the trailing _extra column.
+    fieldnames = list(first.keys())
+    known = set(fieldnames)
+    writer = csv.writer(output)
+    writer.writerow(fieldnames + ["_extra"])
+    count = 0
+    for row in chain([first], rows):
+        extra = {k: v for k, v in row.items() if k not in known}
+        writer.writerow(
+            [csv_value(row.get(k)) for k in fieldnames]
+            + [json.dumps(extra, default=str) if extra else ""]
+        )
+        count += 1
+    return count
+
+
+def write_jsonl(rows, output):
+    count = 0
+    for row in rows:
+        output.write(json.dumps(row, default=str))
+        output.write("\n")
+        count += 1
+    return count
+
+
+EXPORT_FORMATS = {"csv": write_csv, "jsonl": write_jsonl}
+
+
+def dump_sessions(sessions, format, output=None, compress=False):
+    if format not in EXPORT_FORMATS:
+        raise Exception(f"Unsupported format {format}")
+    with open_output(output, compress) as f:
+        count = EXPORT_FORMATS[format](sessions, f)
+    if not count:
+        click.echo("No data to print.", err=True)
+
+
+# LOGIN_HISTORY joined to the SESSIONS that came out of each login. The IP
+# blocklist is loaded once per run into a table of [family, first, last] hex
+# ranges (see hunt_ranges_table), so the filter runs as a server-side range
+# join whatever the size of the blocklist.
+HUNT_QUERY = """
+WITH logins AS (
+    SELECT l.*, PARSE_IP(l.client_ip, 'INET', 1) AS ip
+    FROM SNOWFLAKE.ACCOUNT_USAGE.LOGIN_HISTORY l
+    WHERE l.event_timestamp >= TO_TIMESTAMP_TZ(%(start)s)
+      AND l.event_timestamp < TO_TIMESTAMP_TZ(%(end)s)
+),
+ip_hits AS (
+    SELECT DISTINCT l.event_id
+    FROM logins l
+    JOIN {ranges_table} r
+      ON l.ip:family::int = r.family
+     AND UPPER(COALESCE(l.ip:hex_ipv4, l.ip:hex_ipv6)::string) BETWEEN r.first_ip AND r.last_ip
+)
+SELECT
+    l.event_timestamp AS "event_timestamp",
+    l.event_id AS "login_event_id",
+    l.user_name AS "user_name",
+    l.client_ip AS "client_ip",
+    l.reported_client_type AS "reported_client_type",
+    l.reported_client_version AS "reported_client_version",
+    l.first_authentication_factor AS "first_authentication_factor",
+    l.is_success AS "is_success",
+    l.error_message AS "error_message",
+    s.session_id AS "session_id",
+    s.created_on AS "session_created_on",
+    s.client_application_id AS "client_application_id",
+    s.client_environment AS "client_environment",
+    h.event_id IS NOT NULL AS "ip_blocklisted"
+FROM logins l
+LEFT JOIN ip_hits h ON h.event_id = l.event_id
+LEFT JOIN SNOWFLAKE.ACCOUNT_USAGE.SESSIONS s
+  ON s.login_event_id = l.event_id AND s.created_on >= TO_TIMESTAMP_TZ(%(start)s)
+WHERE h.event_id IS NOT NULL OR ({client_filter})
+ORDER BY l.event_timestamp
+"""
+
+
+def write_hunt_ranges(matcher, path):
+    width = {4: 8, 6: 32}
+    with gzip.open(path, "wt", encoding="utf-8", newline="") as f:
+        writer = csv.writer(f)
+        for version, start, end in matcher.ranges():
+            writer.writerow(
+                [version, f"{start:0{width[version]}X}", f"{end:0{width[version]}X}"]
+            )
+
+
+@contextmanager
+def hunt_ranges_table(schema, matcher, account=None):
+    # A transient table rather than a temporary one: temporary tables are
+    # only visible to the session that created them, and the chunks are
+    # scanned on several pooled sessions. It is loaded with PUT/COPY so the
+    # ranges never appear in statement text, and dropped when the run ends.
+    import tempfile
+
+    name = f"TITAN_HUNT_RANGES_{secrets.token_hex(8).upper()}"
+    table = f"{schema}.{name}"
+    with account_scope(account):
+        execute(
+            f"CREATE TRANSIENT TABLE {table} "
+            "(family INT, first_ip STRING, last_ip STRING) "
+            "DATA_RETENTION_TIME_IN_DAYS = 0"
+        )
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "ranges.csv.gz")
+            write_hunt_ranges(matcher, path)
+            stage = f"@{schema}.%{name}"
+            with account_scope(account):
+                execute(
+                    f"PUT 'file://{path.replace(os.sep, '/')}' '{stage}' "
+                    "AUTO_COMPRESS = FALSE"
+                )
+                execute(
+                    f"COPY INTO {table} FROM '{stage}' "
+                    "FILE_FORMAT = (TYPE = CSV COMPRESSION = GZIP) PURGE = TRUE"
+                )
+        yield table
+    finally:
+        with account_scope(account):
+            execute(f"DROP TABLE IF EXISTS {table}")
+
+
+def hunt_client_filter(rules):
+    # Narrow candidate sessions server-side by the rule index key; the rules
+    # themselves (prefixes, regexes, versions) are applied to what comes back.
+    if not len(rules):
+        return "FALSE", None
+    applications = rules.indexed_values()
+    if applications is None:
+        return "s.client_environment IS NOT NULL", None
+    return (
+        f'PARSE_JSON(s.client_environment):"{rules.index_key}"::string IN '
+        "(SELECT value::string FROM TABLE(FLATTEN(INPUT => PARSE_JSON(%(applications)s))))",
+        json.dumps(sorted(applications)),
+    )
+
+
+def hunt_windows(start, end, chunk):
+    windows = []
+    while start < end:
+        windows.append((start, min(start + chunk, end)))
+        start += chunk
+    return windows
+
+
+def hunt_rows(
+    windows, schema, concurrency=8, fetch_size=1000, max_pending=None, failures=None
+):
+    # Windows that could not be scanned are appended to failures as
+    # (account, window, error) once they fail.
+    client_filter, applications = hunt_client_filter(get_client_environment_rules())
+    matcher = get_ip_matcher()
+    tables = {}
+    # Scanners block once this many batches are waiting to be written, which
+    # bounds memory regardless of how much history matches.
+    batches = queue.Queue(maxsize=max_pending or concurrency * 2)
+    stop = threading.Event()
+    done = object()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                batches.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def scan(account, window):
+        sql = HUNT_QUERY.format(
+            ranges_table=tables[account], client_filter=client_filter
+        )
+        params = {
+            "applications": applications,
+            "start": window[0].isoformat(),
+            "end": window[1].isoformat(),
+        }
+        with account_scope(account):
+            with get_pool().connection() as conn:
+                with conn.cursor(snowflake_connector().DictCursor) as cur:
+                    with timed("execute"):
+                        cur.execute(sql, params)
+                    while not stop.is_set():
+                        with timed("fetch") as sample:
+                            rows = cur.fetchmany(fetch_size)
+                            sample["rows"] = len(rows)
+                        if not rows:
+                            return
+                        matches = []
+                        for row in rows:
+                            row["client_blocklisted"] = bool(
+                                row["client_environment"]
+                            ) and session_client_environment_matches_blocklist(
+                                row["client_environment"]
+                            )
+                            if row["ip_blocklisted"] or row["client_blocklisted"]:
+                                if account is not None:
+                                    row["account"] = account
+                                matches.append(row)
+                        if matches and not put(matches):
+                            return
+
+    def produce():
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            futures = {
+                executor.submit(scan, account, window): (account, window)
+                for account in _accounts
+                for window in windows
+            }
+            for future in as_completed(futures):
+                err = future.exception()
+                if err is not None:
+                    account, (start, end) = futures[future]
+                    if failures is not None:
+                        failures.append((account, (start, end), err))
+                    prefix = f"[{account}] " if account else ""
+                    click.echo(
+                        f"{prefix}Failed to scan {start:%Y-%m-%d %H:%M} to "
+                        f"{end:%Y-%m-%d %H:%M}: {err}",
+                        err=True,
+                    )
+        put(done)
+
+    with ExitStack() as stack:
+        for account in _accounts:
+            tables[account] = stack.enter_context(
+                hunt_ranges_table(schema, matcher, account)
+            )
+        producer = threading.Thread(target=produce, daemon=True)
+        producer.start()
+        try:
+            while True:
+                item = batches.get()
+                if item is done:
+                    return
+                yield from item
+        finally:
+            stop.set()
+            producer.join()
+
+
+def range_to_cidrs(start, end, bits=32):
+    cidrs = []
+    while start <= end:
+        # Largest aligned block starting at start that does not pass end.
+        size = (start & -start).bit_length() - 1 if start else bits
+        while size and start + (1 << size) - 1 > end:
+            size -= 1
+        cidrs.append((start, bits - size))
+        start += 1 << size
+    return cidrs
+
+
+def blocklist_cidrs(matcher):
+    intervals = sorted(
+        (start, end) for version, start, end in matcher.ranges() if version == 4
+    )
+    merged = []
+    for start, end in intervals:
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    values = []
+    for start, end in merged:
+        for network, prefix in range_to_cidrs(start, end):
+            address = socket.inet_ntoa(network.to_bytes(4, "big"))
+            values.append(address if prefix == 32 else f"{address}/{prefix}")
+    return values
+
+
+def network_rule_values(rule):
+    rows = execute(f"DESCRIBE NETWORK RULE {rule}")
+    value_list = (rows[0].get("value_list") or "") if rows else ""
+    return {
+        value.strip().strip("'\"[] ")
+        for value in value_list.split(",")
+        if value.strip().strip("'\"[] ")
+    }
+
+
+def value_list(values):
+    return ", ".join(f"'{value}'" for value in values)
+
+
+def network_policy_steps(
+    rule, policy, desired, current, chunk_size=1000, activate=False
+):
+    steps = []
+    if current is None:
+        initial = sorted(desired)[:chunk_size]
+        steps.append(
+            (
+                f"Created network rule {rule} with {len(initial)} value(s)",
+                f"CREATE NETWORK RULE {rule} TYPE = IPV4 MODE = INGRESS "
+                f"VALUE_LIST = ({value_list(initial)})",
+            )
+        )
+        current = set(initial)
+    for verb, done, values in (
+        ("REMOVE", "Removed", sorted(current - set(desired))),
+        ("ADD", "Added", sorted(set(desired) - current)),
+    ):
+        # Chunked to stay well under Snowflake's statement size limit.
+        for i in range(0, len(values), chunk_size):
+            chunk = values[i : i + chunk_size]
+            steps.append(
+                (
+                    f"{done} {len(chunk)} value(s) in {rule}",
+                    f"ALTER NETWORK RULE {rule} {verb} VALUE_LIST = ({value_list(chunk)})",
+                )
+            )
+    # Also sent when the rule already exists, in case the policy was dropped
+    # or a previous run failed between creating the rule and the policy.
+    steps.append(
+        (
+            f"Ensured network policy {policy} exists",
+            f"CREATE NETWORK POLICY IF NOT EXISTS {policy} "
+            f"BLOCKED_NETWORK_RULE_LIST = ('{rule}')",
+        )
+    )
+    if activate:
+        steps.append(
+            (
+                f"Activated network policy {policy} for the account",
+                f"ALTER ACCOUNT SET NETWORK_POLICY = {policy}",
+            )
+        )
+    return steps
+
+
+def object_name(name):
+    # Last part of a possibly qualified name, normalized the way Snowflake
+    # stores unquoted identifiers.
+    part = name.rsplit(".", 1)[-1]
+    if part.startswith('"') and part.endswith('"'):
+        return part[1:-1]
+    return part.upper()
+
+
+def account_network_policy():
+    rows = execute("SHOW PARAMETERS LIKE 'NETWORK_POLICY' IN ACCOUNT")
+    return rows[0]["value"] if rows else ""
+
+
+def sync_network_policy(
+    rule, policy, chunk_size=1000, activate=False, force=False, dry_run=False
+):
+    matcher = get_ip_matcher()
+    skipped = sum(1 for version, _, _ in matcher.ranges() if version == 6)
+    if skipped:
+        click.echo(
+            f"Skipping {skipped} IPv6 range(s): network rules only block IPv4",
+            err=True,
+        )
+    desired = blocklist_cidrs(matcher)
+    try:
+        current = network_rule_values(rule)
+    except snowflake_connector().errors.ProgrammingError as err:
+        if "does not exist" not in str(err):
+            raise
+        current = None
+    if activate:
+        active = account_network_policy()
+        if active and object_name(active) == object_name(policy):
+            print(f"Network policy {policy} is already active")
+            activate = False
+        elif active and not force:
+            print(
+                f"Not activating {policy}: the account already uses network "
+                f"policy {active} (use --force to replace it)"
+            )
+            return False
+    steps = network_policy_steps(rule, policy, desired, current, chunk_size, activate)
+    if current is not None and current == set(desired):
+        print(f"Network rule {rule} is up to date ({len(desired)} values)")
+    if dry_run:
+        print_batch(steps)
+        return True
+    for description, sql in steps:
+        try:
+            execute_with_retry(sql)
+        except Exception as err:
+            # Later steps depend on earlier ones (the rule has to exist before
+            # values are added), so stop at the first failure.
+            print(f"Failed: {description}: {err}")
+            return False
+        print(description)
+    return True
+
+
+SESSION_SNAPSHOT_COLUMNS = [
+    ("snapshotTime", "timestamp"),
+    ("id", "int"),
+    ("idAsString", "string"),
+    ("userName", "category"),
+    ("isActive", "bool"),
+    ("startTime", "epoch_ms"),
+    ("endTime", "epoch_ms"),
+    ("clientEnvironment", "string"),
+    ("clientApplication", "category"),
+    ("clientNetAddress", "category"),
+    ("clientBuildId", "category"),
+    ("accountName", "category"),
+    ("authnMethod", "category"),
+    ("defaultNamespace", "category"),
+    ("lastQueryShort", "string"),
+    ("lastQueryId", "string"),
+]
+
+USER_SNAPSHOT_COLUMNS = [
+    ("snapshot_time", "timestamp"),
+    ("name", "string"),
+    ("created_on", "timestamp"),
+    ("login_name", "string"),
+    ("display_name", "string"),
+    ("first_name", "string"),
+    ("last_name", "string"),
+    ("email", "string"),
+    ("comment", "string"),
+    ("disabled", "bool"),
+    ("must_change_password", "bool"),
+    ("snowflake_lock", "bool"),
+    ("default_warehouse", "category"),
+    ("default_namespace", "category"),
+    ("default_role", "category"),
+    ("owner", "category"),
+    ("type", "category"),
+    ("last_success_login", "timestamp"),
+    ("expires_at_time", "timestamp"),
+    ("locked_until_time", "timestamp"),
+    ("has_password", "bool"),
+    ("has_rsa_public_key", "bool"),
+    ("has_mfa", "bool"),
+]
+
+
+def import_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet  # noqa: F401
+    except ImportError:
+        raise click.ClickException(
+            "Parquet and Arrow exports require pyarrow: pip install pyarrow"
+        )
+    return pyarrow
+
+
+def arrow_column(pa, kind, values):
+    if kind == "bool":
+        values = [
+            (
+                None
+                if v is None
+                else (v.lower() == "true" if isinstance(v, str) else bool(v))
+            )
+            for v in values
+        ]
+        return pa.array(values, type=pa.bool_())
+    if kind == "int":
+        return pa.array(values, type=pa.int64())
+    if kind == "epoch_ms":
+        return pa.array(values, type=pa.timestamp("ms", tz="UTC"))
+    if kind == "timestamp":
+        return pa.array(values, type=pa.timestamp("us", tz="UTC"))
+    values = [None if v is None else str(v) for v in values]
+    if kind == "category":
+        return pa.array(values, type=pa.string()).dictionary_encode()
+    return pa.array(values, type=pa.string())
+
+
+def snapshot_table(rows, columns, snapshot_time):
+    pa = import_pyarrow()
+    snapshot_column = columns[0][0]
+    arrays = []
+    for name, kind in columns:
+        if name == snapshot_column:
+            values = [snapshot_time] * len(rows)
+        else:
+            values = [row.get(name) for row in rows]
+        arrays.append(arrow_column(pa, kind, values))
+    return pa.Table.from_arrays(arrays, names=[name for name, _ in columns])
+
+
+def write_snapshot(rows, columns, format, output, partition=False, prefix="snapshot"):
+    pa = import_pyarrow()
+    snapshot_time = datetime.now(timezone.utc)
+    table = snapshot_table(rows, columns, snapshot_time)
+    if partition:
+        directory = os.path.join(
+            output, f"snapshot_date={snapshot_time.strftime('%Y-%m-%d')}"
+        )
+        os.makedirs(directory, exist_ok=True)
+        extension = "parquet" if format == "parquet" else "arrow"
+        output = os.path.join(
+            directory,
+            f"{prefix}-{snapshot_time.strftime('%Y%m%dT%H%M%S%fZ')}.{extension}",
+        )
+    if format == "parquet":
+        pa.parquet.write_table(table, output, compression="zstd")
+    else:
+        with pa.ipc.new_file(output, table.schema) as writer:
+            writer.write_table(table)
+    return output
 
 
 def kill_session_by_id(id: int):
-    res = execute(f"SELECT SYSTEM$ABORT_SESSION({id})")[0]
-    return res is not None
+    # Rows come back as dicts keyed by the column name, so unwrap the single
+    # value; a NULL result means the session was not aborted.
+    row = execute(f"SELECT SYSTEM$ABORT_SESSION({id})")[0]
+    return next(iter(row.values())) is not None
+
+
+class RateLimiter:
+    def __init__(self, rate=None):
+        self.interval = 1 / rate if rate else 0
+        self._lock = threading.Lock()
+        self._next = time.monotonic()
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            delay = self._next - now
+            self._next = max(self._next, now) + self.interval
+        if delay > 0:
+            time.sleep(delay)
+
+
+def session_key(session):
+    return (session.get("account"), session["id"])
 
 
-def kill_sessions_interactive(sessions: list[dict]):
-    to_kill = sessions
+def kill_sessions_interactive(
+    sessions: list[dict], concurrency=8, rate=50, refresh_interval=0.2
+):
+    status = {session_key(session): "Active" for session in sessions}
     actioned = []
+    limiter = RateLimiter(rate)
 
     terminal_lines = shutil.get_terminal_size((80, 20)).lines
     display_limit = terminal_lines - 5
 
+    headers = ["User", "ID", "IP", "Status"]
+    if sessions and "account" in sessions[0]:
+        headers.insert(0, "Account")
+
     def session_record(session):
-        return [session["userName"], session["id"], session["clientNetAddress"]]
+        record = [session["userName"], session["id"], session["clientNetAddress"]]
+        return [session["account"], *record] if "account" in session else record
 
     def render():
-        clear_terminal()
-        data = actioned + [[*session_record(s), "Active"] for s in to_kill]
-        if len(data) > display_limit:
-            data_size = len(data)
-            data = data[:display_limit]
-            data.append(["..."] * 3)
-            data.append([f"And {data_size - display_limit} more"] + [""] * 3)
-        print(tabulate(data, headers=["User", "ID", "IP", "Status"]))
-
-    with connect() as conn:
-        with conn.cursor() as cur:
-            while to_kill:
+        active = (
+            [*session_record(s), "Active"]
+            for s in sessions
+            if status[session_key(s)] == "Active"
+        )
+        data = list(islice(chain(actioned, active), display_limit))
+        if len(sessions) > display_limit:
+            data.append(["..."] * (len(headers) - 1))
+            data.append(
+                [f"And {len(sessions) - display_limit} more"]
+                + [""] * (len(headers) - 1)
+            )
+        redraw(tabulate(data, headers=headers))
+
+    def kill(session):
+        limiter.wait()
+        with account_scope(session.get("account")):
+            return kill_session_by_id(session["id"])
+
+    started = time.monotonic()
+    clear_terminal()
+    render()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        pending = {executor.submit(kill, session): session for session in sessions}
+        last_render = time.monotonic()
+        while pending:
+            done, _ = wait(
+                pending, timeout=refresh_interval, return_when=FIRST_COMPLETED
+            )
+            for future in done:
+                session = pending.pop(future)
+                killed = future.exception() is None and future.result()
+                status[session_key(session)] = "Killed" if killed else "Failed"
+                actioned.append(
+                    [*session_record(session), status[session_key(session)]]
+                )
+            if done and time.monotonic() - last_render >= refresh_interval:
                 render()
-                time.sleep(0.05)
-                session = to_kill.pop(0)
-                res = cur.execute(
-                    f"SELECT SYSTEM$ABORT_SESSION({session['id']})"
-                ).fetchone()[0]
-                if res is not None:
-                    actioned.append([*session_record(session), "Killed"])
-                else:
-                    actioned.append([*session_record(session), "Failed"])
+                last_render = time.monotonic()
     render()
+    killed = sum(1 for value in status.values() if value == "Killed")
+    print(
+        f"\nKilled {killed}, failed {len(status) - killed} "
+        f"in {time.monotonic() - started:.1f}s"
+    )
+
+
+def state_path(name):
+    load_env()
+    directory = os.environ.get("TITAN_STATE_DIR", os.path.expanduser("~/.titan"))
+    os.makedirs(directory, mode=0o700, exist_ok=True)
+    return os.path.join(directory, name)
+
+
+def write_json_atomic(path, data, default=None):
+    tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with os.fdopen(
+        os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), "w"
+    ) as f:
+        json.dump(data, f, default=default)
+    os.replace(tmp, path)
+
+
+def log(message):
+    print(f"{time.strftime('%Y-%m-%d %H:%M:%S')} {message}", flush=True)
+
+
+class DaemonState:
+    def __init__(self, path=None, max_entries=100_000):
+        self.path = path
+        self.max_entries = max_entries
+        self.sessions = OrderedDict()
+        self.users = OrderedDict()
+        if path and os.path.exists(path):
+            with open(path) as f:
+                data = json.load(f)
+            self.sessions.update((id, ts) for id, ts in data.get("sessions", []))
+            self.users.update((name, ts) for name, ts in data.get("users", []))
+
+    def _remember(self, entries, key):
+        entries[key] = time.time()
+        entries.move_to_end(key)
+        while len(entries) > self.max_entries:
+            entries.popitem(last=False)
+
+    def session_handled(self, id):
+        return id in self.sessions
+
+    def user_handled(self, name, cooldown):
+        return time.time() - self.users.get(name, 0) < cooldown
+
+    def mark_session(self, id):
+        self._remember(self.sessions, id)
+
+    def mark_user(self, name):
+        self._remember(self.users, name)
+
+    def save(self):
+        if self.path:
+            write_json_atomic(
+                self.path,
+                {
+                    "sessions": list(self.sessions.items()),
+                    "users": list(self.users.items()),
+                },
+            )
+
+
+def respond_reset(session):
+    steps = reset_user_credentials_tracked({"name": session["userName"]})
+    failed = [description for description, err in steps if err]
+    if failed:
+        raise Exception(f"Failed steps: {', '.join(failed)}")
+    return True
+
+
+DAEMON_RESPONSES = {
+    "kill": lambda session: kill_session_by_id(session["id"]),
+    "disable": lambda session: disable_user_account({"name": session["userName"]}),
+    "reset": respond_reset,
+}
+
+
+def response_target(response, session):
+    if response == "kill":
+        return f"session {session['id']}"
+    return f"user {session['userName']}"
+
+
+def run_daemon(
+    responses=("kill",),
+    interval=5.0,
+    state_file=None,
+    concurrency=8,
+    user_cooldown=3600,
+    max_attempts=3,
+    dry_run=False,
+    history=None,
+    baseline=None,
+):
+    state = DaemonState(state_file)
+    watcher = SessionWatcher(baseline)
+    attempts = {}
+    in_flight = {}
+    log(
+        f"Watching sessions every {interval}s, responding with {', '.join(responses)}"
+        + (" (dry run)" if dry_run else "")
+    )
+
+    def task_key(response, session):
+        if response == "kill":
+            return ("session", session["id"])
+        return ("user", f"{response}:{session['userName']}")
+
+    def is_handled(key):
+        kind, value = key
+        if kind == "session":
+            return state.session_handled(value)
+        return state.user_handled(value, user_cooldown)
+
+    def mark_handled(key):
+        kind, value = key
+        if kind == "session":
+            state.mark_session(value)
+        else:
+            state.mark_user(value)
+
+    def collect(futures):
+        for future in futures:
+            key, response, session = in_flight.pop(future)
+            target = response_target(response, session)
+            err = future.exception()
+            if err is None and future.result() is not False:
+                log(f"{response} {target}: done")
+            else:
+                attempts[key] = attempts.get(key, 0) + 1
+                log(f"{response} {target}: failed ({err}), attempt {attempts[key]}")
+                if attempts[key] < max_attempts:
+                    continue
+            attempts.pop(key, None)
+            mark_handled(key)
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        while True:
+            started = time.monotonic()
+            try:
+                sessions = get_sessions()
+            except Exception as err:
+                log(f"Failed to fetch sessions: {err}")
+                sessions = None
+            if sessions is not None:
+                if history:
+                    history.record(sessions)
+                for kind, session, suspicious in watcher.update(sessions):
+                    if kind != "removed" and suspicious:
+                        log(
+                            f"Suspicious session {session['id']} for "
+                            f"{session['userName']} from {session['clientNetAddress']}"
+                        )
+                queued = {(key, response) for key, response, _ in in_flight.values()}
+                for id, suspicious in watcher.suspicious.items():
+                    if not suspicious:
+                        continue
+                    session = watcher.sessions[id]
+                    for response in responses:
+                        key = task_key(response, session)
+                        if is_handled(key) or (key, response) in queued:
+                            continue
+                        queued.add((key, response))
+                        if dry_run:
+                            target = response_target(response, session)
+                            log(f"{response} {target} (dry run)")
+                            mark_handled(key)
+                            continue
+                        future = executor.submit(DAEMON_RESPONSES[response], session)
+                        in_flight[future] = (key, response, session)
+            collect([future for future in list(in_flight) if future.done()])
+            if not dry_run:
+                state.save()
+            export_metrics()
+            elapsed = time.monotonic() - started
+            if elapsed > interval:
+                log(f"Poll took {elapsed:.1f}s, longer than the {interval}s interval")
+            time.sleep(max(interval - elapsed, 0))
+
+
+# Session fields that identify a distinct observation of a session. Fields
+# such as lastQueryId change on every query and are deliberately left out so
+# that unchanged sessions collapse into a single history row across polls.
+HISTORY_FINGERPRINT_FIELDS = [
+    "userName",
+    "isActive",
+    "endTime",
+    "clientEnvironment",
+    "clientApplication",
+    "clientNetAddress",
+    "authnMethod",
+]
+
+
+class SessionHistory:
+    def __init__(self, path, touch_interval=60, max_tracked=500_000):
+        self.touch_interval = touch_interval
+        self.max_tracked = max_tracked
+        self._written = {}
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.row_factory = sqlite3.Row
+        self.lock = threading.Lock()
+        with self.db:
+            self.db.execute("PRAGMA journal_mode=WAL")
+            self.db.executescript("""
+                CREATE TABLE IF NOT EXISTS sessions (
+                    account TEXT NOT NULL,
+                    id INTEGER NOT NULL,
+                    fingerprint TEXT NOT NULL,
+                    userName TEXT,
+                    clientNetAddress TEXT,
+                    clientApplication TEXT,
+                    authnMethod TEXT,
+                    startTime INTEGER,
+                    firstSeen REAL NOT NULL,
+                    lastSeen REAL NOT NULL,
+                    payload TEXT NOT NULL,
+                    PRIMARY KEY (account, id, fingerprint)
+                );
+                CREATE INDEX IF NOT EXISTS sessions_user
+                    ON sessions (userName COLLATE NOCASE, startTime);
+                CREATE INDEX IF NOT EXISTS sessions_ip
+                    ON sessions (clientNetAddress, startTime);
+                CREATE INDEX IF NOT EXISTS sessions_start ON sessions (startTime);
+                CREATE INDEX IF NOT EXISTS sessions_last_seen ON sessions (lastSeen);
+                """)
+
+    def record(self, sessions, seen_at=None):
+        seen_at = seen_at or time.time()
+        if len(self._written) > self.max_tracked:
+            self._written.clear()
+        rows = []
+        for session in sessions:
+            fingerprint = hashlib.sha1(
+                json.dumps(
+                    [session.get(k) for k in HISTORY_FINGERPRINT_FIELDS], default=str
+                ).encode()
+            ).hexdigest()
+            key = (session.get("account") or "", session["id"], fingerprint)
+            # Unchanged sessions only need lastSeen refreshed now and then.
+            if seen_at - self._written.get(key, 0) < self.touch_interval:
+                continue
+            self._written[key] = seen_at
+            rows.append(
+                (
+                    *key,
+                    session.get("userName"),
+                    session.get("clientNetAddress"),
+                    session.get("clientApplication"),
+                    session.get("authnMethod"),
+                    session.get("startTime"),
+                    seen_at,
+                    seen_at,
+                    json.dumps(session, default=str),
+                )
+            )
+        with self.lock, self.db:
+            self.db.executemany(
+                """
+                INSERT INTO sessions VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (account, id, fingerprint) DO UPDATE
+                SET lastSeen = excluded.lastSeen, payload = excluded.payload
+                """,
+                rows,
+            )
+        return len(rows)
+
+    def search(self, user=None, ip=None, since=None, until=None, limit=100):
+        clauses, params = [], []
+        if user:
+            clauses.append("userName = ? COLLATE NOCASE")
+            params.append(user)
+        if ip:
+            clauses.append("clientNetAddress = ?")
+            params.append(ip)
+        if since:
+            clauses.append("startTime >= ?")
+            params.append(int(since.timestamp() * 1000))
+        if until:
+            clauses.append("startTime < ?")
+            params.append(int(until.timestamp() * 1000))
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        with self.lock:
+            return self.db.execute(
+                f"SELECT * FROM sessions {where} ORDER BY startTime DESC LIMIT ?",
+                [*params, limit],
+            ).fetchall()
+
+    def ip_summary(self, ip):
+        with self.lock:
+            return self.db.execute(
+                """
+                SELECT userName, account, COUNT(DISTINCT id) AS sessions,
+                    MIN(firstSeen) AS firstSeen, MAX(lastSeen) AS lastSeen
+                FROM sessions WHERE clientNetAddress = ?
+                GROUP BY userName, account ORDER BY firstSeen
+                """,
+                [ip],
+            ).fetchall()
+
+    def compact(self, retention_days):
+        cutoff = time.time() - retention_days * 24 * 60 * 60
+        with self.lock:
+            with self.db:
+                deleted = self.db.execute(
+                    "DELETE FROM sessions WHERE lastSeen < ?", [cutoff]
+                ).rowcount
+            self.db.execute("VACUUM")
+            self.db.execute("PRAGMA optimize")
+        return deleted
+
+    def close(self):
+        self.db.close()
+
+
+def open_history(path=None):
+    load_env()
+    return SessionHistory(
+        path or os.environ.get("TITAN_HISTORY_DB") or state_path("history.db")
+    )
+
+
+def format_timestamp(seconds):
+    return datetime.fromtimestamp(seconds).strftime("%Y-%m-%d %H:%M:%S")
 
 
 # ----------------------
@@ -615,9 +3160,128 @@ def kill_sessions_interactive(sessions: list[dict]):
 
 
 @click.group()
-def cli():
+@click.option(
+    "--ip-blocklist",
+    multiple=True,
+    type=click.Path(exists=True, dir_okay=False),
+    help="File of blocklisted IPs, CIDR ranges or first-last ranges, one per line",
+)
+@click.option(
+    "--accounts",
+    "accounts_file",
+    type=click.Path(exists=True, dir_okay=False),
+    envvar="TITAN_ACCOUNTS",
+    help="INI file of Snowflake account profiles to run commands against",
+)
+@click.option(
+    "--account",
+    "account_names",
+    multiple=True,
+    help="Profile from --accounts to use (repeatable, default: all)",
+)
+@click.option(
+    "--account-concurrency",
+    default=8,
+    type=click.IntRange(min=1),
+    help="Number of accounts to query in parallel",
+)
+@click.option(
+    "--user-cache-ttl",
+    type=float,
+    envvar="TITAN_USER_CACHE_TTL",
+    default=300,
+    help="Seconds to reuse the cached user list (0 to always run show users)",
+)
+@click.option(
+    "--feeds",
+    type=click.Path(exists=True, file_okay=False),
+    envvar="TITAN_FEED_DIR",
+    help="Directory of threat-intel feeds (txt, csv, STIX-like json), "
+    "reloaded in the background when files change",
+)
+@click.option(
+    "--feed-interval",
+    default=30.0,
+    type=float,
+    help="Seconds between checks for changed feed files",
+)
+@click.option(
+    "--profile",
+    is_flag=True,
+    help="Print connect, query and REST timings to stderr when the command ends",
+)
+@click.option(
+    "--metrics-file",
+    type=click.Path(dir_okay=False, writable=True),
+    envvar="TITAN_METRICS_FILE",
+    help="Write call metrics to this file (JSON if it ends in .json, otherwise "
+    "OpenMetrics text), refreshed periodically by watch and daemon",
+)
+@click.option(
+    "--metrics-interval",
+    default=15.0,
+    type=float,
+    help="Seconds between metrics file updates in watch and daemon",
+)
+@click.option(
+    "--session-cache/--no-session-cache",
+    default=True,
+    envvar="TITAN_SESSION_CACHE",
+    help="Reuse Snowflake sessions across runs instead of logging in every time",
+)
+def cli(
+    ip_blocklist,
+    accounts_file,
+    account_names,
+    account_concurrency,
+    user_cache_ttl,
+    feeds,
+    feed_interval,
+    profile,
+    metrics_file,
+    metrics_interval,
+    session_cache,
+):
     """Main CLI group"""
-    pass
+    global _accounts, _account_concurrency, _default_account, _user_cache_ttl
+    global _metrics_file, _metrics_interval, _session_cache_enabled
+    _session_cache_enabled = session_cache
+    _user_cache_ttl = user_cache_ttl
+    _metrics_file = metrics_file
+    _metrics_interval = metrics_interval
+    _metrics.measure_payload = profile or bool(metrics_file)
+    ctx = click.get_current_context()
+    stop_profiler = start_profiler()
+    if stop_profiler:
+        ctx.call_on_close(stop_profiler)
+    if profile:
+        ctx.call_on_close(lambda: click.echo("\n" + _metrics.summary(), err=True))
+    if metrics_file:
+        ctx.call_on_close(lambda: export_metrics(force=True))
+    if ip_blocklist:
+        load_ip_blocklist(ip_blocklist)
+    if feeds:
+        # Stop reloading once the command is done, so a feed change cannot
+        # swap the matchers while the process shuts down.
+        ctx.call_on_close(ThreatFeed(feeds, feed_interval).start().stop)
+    if accounts_file:
+        profiles = load_profiles(accounts_file)
+        unknown = set(account_names) - set(profiles)
+        if unknown:
+            raise click.BadParameter(
+                f"Unknown account profile(s): {', '.join(sorted(unknown))}",
+                param_hint="--account",
+            )
+        _accounts = list(account_names or profiles)
+        _account_concurrency = account_concurrency
+        # Single-account commands (watch, export, daemon, kill --id) refuse
+        # to run with more than one profile selected; see
+        # require_single_account.
+        _default_account = _accounts[0]
+    elif account_names:
+        raise click.BadParameter(
+            "--account requires --accounts", param_hint="--account"
+        )
 
 
 @cli.group()
@@ -629,27 +3293,85 @@ def sessions():
 @sessions.command(name="list")
 @click.option(
     "--format",
-    type=click.Choice(["csv", "table"], case_sensitive=False),
+    type=click.Choice(["csv", "jsonl", "table"], case_sensitive=False),
     default="table",
-    help="Output format: csv or table",
+    help="Output format: csv, jsonl or table",
 )
 @click.option(
     "--limit", default=25, type=int, help="Limit the number of sessions to list"
 )
-def list_sessions(format, limit):
+@click.option(
+    "--output",
+    type=click.Path(dir_okay=False, writable=True),
+    help="Write csv/jsonl output to a file instead of stdout",
+)
+@click.option("--gzip", "compress", is_flag=True, help="Gzip csv/jsonl output")
+def list_sessions(format, limit, output, compress):
     """List all sessions"""
-    sessions = get_sessions()
-    if format == "csv":
-        dump_sessions(sessions, format)
+    sessions = fetch_sessions()
+    if format in EXPORT_FORMATS:
+        dump_sessions(sessions, format, output, compress)
     else:
         print_sessions(sessions, display_limit=limit)
 
 
+def snapshot_options(fn):
+    fn = click.option(
+        "--partition",
+        is_flag=True,
+        help="Treat --output as a directory partitioned by snapshot_date",
+    )(fn)
+    fn = click.option(
+        "--output",
+        required=True,
+        type=click.Path(writable=True),
+        help="File to write, or directory with --partition",
+    )(fn)
+    fn = click.option(
+        "--format",
+        type=click.Choice(["parquet", "arrow"], case_sensitive=False),
+        default="parquet",
+        help="Output format: parquet or arrow (IPC file)",
+    )(fn)
+    return fn
+
+
+@sessions.command(name="export")
+@snapshot_options
+def export_sessions(format, output, partition):
+    """Export a snapshot of all sessions to Parquet or Arrow"""
+    require_single_account("sessions export")
+    sessions = get_sessions()
+    path = write_snapshot(
+        sessions, SESSION_SNAPSHOT_COLUMNS, format, output, partition, "sessions"
+    )
+    print(f"Exported {len(sessions)} sessions to {path}")
+
+
 @sessions.command()
 @click.option("--user", type=str, help="Username to filter sessions by")
-def watch(user):
+@click.option(
+    "--min-interval", default=0.5, type=float, help="Fastest polling interval (s)"
+)
+@click.option(
+    "--max-interval", default=5.0, type=float, help="Slowest polling interval (s)"
+)
+@click.option(
+    "--record", is_flag=True, help="Record every poll in the local session history"
+)
+@click.option(
+    "--anomalies",
+    is_flag=True,
+    help="Flag sessions that deviate from each user's usual IPs, applications, "
+    "authentication methods and operating systems, and count that towards "
+    "their risk score",
+)
+def watch(user, min_interval, max_interval, record, anomalies):
     """Watch sessions in real-time"""
-    watch_sessions(user)
+    require_single_account("sessions watch")
+    history = open_history() if record else None
+    baseline = UserBaseline() if anomalies else None
+    watch_sessions(user, min_interval, max_interval, history=history, baseline=baseline)
 
 
 @sessions.command()
@@ -657,35 +3379,240 @@ def watch(user):
 @click.option("--id", type=int, help="ID of the session to kill")
 @click.option("--user", type=str, help="Username of the sessions to kill")
 @click.option("--suspicious", is_flag=True, help="Kill all suspicious sessions")
-def kill(all, id, user, suspicious):
+@click.option(
+    "--concurrency",
+    default=8,
+    type=click.IntRange(min=1),
+    help="Number of sessions to kill in parallel",
+)
+@click.option(
+    "--rate",
+    default=50.0,
+    type=float,
+    help="Maximum kills per second (0 for unlimited)",
+)
+def kill(all, id, user, suspicious, concurrency, rate):
     """Kill a specific session by ID or all sessions"""
+    ensure_pool_size(concurrency)
     if all:
-        sessions = get_sessions()
-        kill_sessions_interactive(sessions)
+        sessions = fetch_sessions()
+        kill_sessions_interactive(sessions, concurrency, rate)
     elif id is not None:
+        require_single_account("--id")
         if kill_session_by_id(id):
             print(f"Killed session {id}")
         else:
             print(f"Failed to kill session {id}")
     elif user is not None:
-        sessions = get_sessions()
+        sessions = fetch_sessions()
         sessions = [
             session
             for session in sessions
             if session["userName"].lower() == user.lower()
         ]
-        kill_sessions_interactive(sessions)
+        kill_sessions_interactive(sessions, concurrency, rate)
     elif suspicious:
-        sessions = get_sessions()
+        sessions = fetch_sessions()
 
-        sessions = [session for session in sessions if session_is_suspicious(session)]
-        kill_sessions_interactive(sessions)
+        sessions = suspicious_sessions(sessions)
+        kill_sessions_interactive(sessions, concurrency, rate)
     else:
         click.echo(
             "Please provide either --all to kill all sessions or --id=<id> to kill a specific session."
         )
 
 
+@cli.command()
+@click.option(
+    "--response",
+    "responses",
+    multiple=True,
+    type=click.Choice(list(DAEMON_RESPONSES)),
+    default=["kill"],
+    help="Action to take for each suspicious session (repeatable)",
+)
+@click.option("--interval", default=5.0, type=float, help="Polling interval (s)")
+@click.option(
+    "--state-file",
+    type=click.Path(dir_okay=False),
+    help="File recording handled sessions and users [default: ~/.titan/daemon.json]",
+)
+@click.option(
+    "--concurrency",
+    default=8,
+    type=click.IntRange(min=1),
+    help="Number of responses to run in parallel",
+)
+@click.option(
+    "--user-cooldown",
+    default=3600,
+    type=int,
+    help="Seconds before the same user is disabled or reset again",
+)
+@click.option("--dry-run", is_flag=True, help="Log the responses without running them")
+@click.option(
+    "--record", is_flag=True, help="Record every poll in the local session history"
+)
+@click.option(
+    "--anomalies",
+    is_flag=True,
+    help="Also respond to sessions whose deviations from the user's usual IPs, "
+    "applications, authentication methods and operating systems add up to a "
+    "suspicious risk score",
+)
+def daemon(
+    responses,
+    interval,
+    state_file,
+    concurrency,
+    user_cooldown,
+    dry_run,
+    record,
+    anomalies,
+):
+    """Continuously detect and respond to suspicious sessions"""
+    require_single_account("daemon")
+    ensure_pool_size(concurrency + 1)
+    run_daemon(
+        responses,
+        interval,
+        state_file or state_path("daemon.json"),
+        concurrency,
+        user_cooldown,
+        dry_run=dry_run,
+        history=open_history() if record else None,
+        baseline=UserBaseline() if anomalies else None,
+    )
+
+
+@cli.command()
+@click.option(
+    "--since",
+    type=click.DateTime(),
+    help="Start of the range in UTC [default: --days ago]",
+)
+@click.option(
+    "--until", type=click.DateTime(), help="End of the range in UTC [default: now]"
+)
+@click.option(
+    "--days", default=7, type=int, help="Days to search when --since is not given"
+)
+@click.option(
+    "--chunk-hours",
+    default=6.0,
+    type=click.FloatRange(min=0, min_open=True),
+    help="Hours of history scanned by each query",
+)
+@click.option(
+    "--concurrency",
+    default=8,
+    type=click.IntRange(min=1),
+    help="Number of chunks to scan in parallel",
+)
+@click.option(
+    "--format",
+    type=click.Choice(list(EXPORT_FORMATS), case_sensitive=False),
+    default="jsonl",
+    help="Output format: csv or jsonl",
+)
+@click.option(
+    "--output",
+    type=click.Path(dir_okay=False, writable=True),
+    help="Write results to a file instead of stdout",
+)
+@click.option("--gzip", "compress", is_flag=True, help="Gzip the output")
+@click.option(
+    "--schema",
+    required=True,
+    envvar="TITAN_HUNT_SCHEMA",
+    help="DB.SCHEMA where a scratch table of blocklisted IP ranges is created "
+    "for the run and dropped afterwards",
+)
+def hunt(
+    since, until, days, chunk_hours, concurrency, format, output, compress, schema
+):
+    """Search login and session history for blocklisted IPs and clients"""
+    until = until.replace(tzinfo=timezone.utc) if until else datetime.now(timezone.utc)
+    since = (
+        since.replace(tzinfo=timezone.utc) if since else until - timedelta(days=days)
+    )
+    windows = hunt_windows(since, until, timedelta(hours=chunk_hours))
+    ensure_pool_size(concurrency)
+    failures = []
+    rows = hunt_rows(windows, schema, concurrency, failures=failures)
+    dump_sessions(rows, format, output, compress)
+    if failures:
+        # Partial results are still written, but must not pass for "no hits".
+        click.echo(
+            f"{len(failures)} of {len(windows) * len(_accounts)} window(s) "
+            "could not be scanned",
+            err=True,
+        )
+        sys.exit(1)
+
+
+@cli.group()
+def policy():
+    """Manage network policies"""
+    pass
+
+
+def validate_rule_name(ctx, param, value):
+    # Network rules are schema objects and connections have no default
+    # database or schema, so the name must be fully qualified.
+    if value is not None and len(value.split(".")) != 3:
+        raise click.BadParameter(f"{value!r} is not qualified, expected DB.SCHEMA.NAME")
+    return value
+
+
+@policy.command(name="sync")
+@click.option(
+    "--rule",
+    envvar="TITAN_NETWORK_RULE",
+    required=True,
+    callback=validate_rule_name,
+    help="Network rule holding the blocklist, as DB.SCHEMA.NAME",
+)
+@click.option(
+    "--policy",
+    "policy_name",
+    envvar="TITAN_NETWORK_POLICY",
+    default="TITAN_IP_BLOCKLIST",
+    help="Network policy that blocks the rule, created if missing",
+)
+@click.option(
+    "--chunk-size",
+    default=1000,
+    type=click.IntRange(min=1),
+    help="Values per ALTER NETWORK RULE statement",
+)
+@click.option(
+    "--activate",
+    is_flag=True,
+    help="Set the policy as the account network policy if none is active",
+)
+@click.option(
+    "--force",
+    is_flag=True,
+    help="With --activate, replace a different active network policy",
+)
+@click.option(
+    "--dry-run", is_flag=True, help="Print the statements without running them"
+)
+def sync_policy(rule, policy_name, chunk_size, activate, force, dry_run):
+    """Sync the IP blocklist into a Snowflake network rule"""
+    ok = True
+    for account in _accounts:
+        with account_scope(account):
+            if account is not None:
+                print(f"-- {account}")
+            ok &= sync_network_policy(
+                rule, policy_name, chunk_size, activate, force, dry_run
+            )
+    if not ok:
+        sys.exit(1)
+
+
 @cli.group()
 def users():
     """Manage users"""
@@ -696,62 +3623,232 @@ def users():
 @click.option("--suspicious", is_flag=True, help="List only suspicious users")
 def list_users(suspicious):
     """List all users"""
-    users = get_users()
+    users = fetch_users()
     if suspicious:
-        sessions = get_sessions()
+        sessions = fetch_sessions()
         users = get_suspicious_users(users, sessions)
     print_users(users)
 
 
+@users.command(name="export")
+@snapshot_options
+def export_users(format, output, partition):
+    """Export a snapshot of all users to Parquet or Arrow"""
+    require_single_account("users export")
+    users = get_users()
+    path = write_snapshot(
+        users, USER_SNAPSHOT_COLUMNS, format, output, partition, "users"
+    )
+    print(f"Exported {len(users)} users to {path}")
+
+
+def inactive_options(fn):
+    fn = click.option(
+        "--inactive-source",
+        type=click.Choice(["result_scan", "account_usage", "show_users"]),
+        default="result_scan",
+        help="Where inactivity is computed: filtered server-side over SHOW USERS, "
+        "ACCOUNT_USAGE.USERS (may lag), or client-side over streamed SHOW USERS",
+    )(fn)
+    fn = click.option(
+        "--inactive-days",
+        default=90,
+        type=click.IntRange(min=0),
+        help="Days without a successful login before a user is inactive",
+    )(fn)
+    return fn
+
+
 @users.command(name="disable")
 @click.option("--user", type=str, help="Username of the user to disable")
 @click.option("--suspicious", is_flag=True, help="Disable all suspicious users")
 @click.option("--inactive", is_flag=True, help="Disable all inactive users")
-def disable_user(user, suspicious, inactive):
+@click.option(
+    "--batch", is_flag=True, help="Send all statements in multi-statement requests"
+)
+@click.option(
+    "--dry-run", is_flag=True, help="Print the compiled batch without running it"
+)
+@inactive_options
+def disable_user(
+    user, suspicious, inactive, inactive_days, inactive_source, batch, dry_run
+):
     """Disable user accounts based on the given criteria"""
-    users = get_users()
     if user:
-        users = [u for u in users if u["name"].lower() == user.lower()]
-        for u in users:
-            disable_user_account(u)
-            print(f"Disabled user {u['name']}")
+        users = fetch_user(user)
+        label = "user"
     elif suspicious:
-        sessions = get_sessions()
-        suspicious_users = get_suspicious_users(users, sessions)
-        for u in suspicious_users:
-            disable_user_account(u)
-            print(f"Disabled suspicious user {u['name']}")
+        users = fetch_suspicious_users()
+        label = "suspicious user"
     elif inactive:
-        inactive_users = get_inactive_users(users)
-        for u in inactive_users:
-            disable_user_account(u)
-            print(f"Disabled inactive user {u['name']}")
+        users = fetch_inactive_users(inactive_days, inactive_source)
+        label = "inactive user"
     else:
         click.echo("Please specify a user, --suspicious, or --inactive option.")
+        return
+    if batch or dry_run:
+        disable_users_batched(users, dry_run)
+        return
+    for u in users:
+        disable_user_account(u)
+        print(f"Disabled {label} {u['name']}")
 
 
 @users.command()
 @click.option("--user", type=str, help="Username of the user to disable")
 @click.option("--suspicious", is_flag=True, help="Disable all suspicious users")
 @click.option("--inactive", is_flag=True, help="Disable all inactive users")
-def reset(user, suspicious, inactive):
-    users = get_users()
+@click.option(
+    "--concurrency",
+    default=8,
+    type=click.IntRange(min=1),
+    help="Number of users to reset in parallel",
+)
+@click.option(
+    "--retries",
+    default=2,
+    type=click.IntRange(min=0),
+    help="Retries for transient failures per step",
+)
+@click.option(
+    "--batch",
+    is_flag=True,
+    help="Send each user's steps as one multi-statement request",
+)
+@click.option(
+    "--dry-run", is_flag=True, help="Print the compiled batches without running them"
+)
+@inactive_options
+def reset(
+    user,
+    suspicious,
+    inactive,
+    inactive_days,
+    inactive_source,
+    concurrency,
+    retries,
+    batch,
+    dry_run,
+):
+    ensure_pool_size(concurrency)
     if user:
-        users = [u for u in users if u["name"].lower() == user.lower()]
-        for u in users:
-            reset_user_credentials(u)
-            print(f"Reset user {u['name']}")
+        users = fetch_user(user)
     elif suspicious:
-        sessions = get_sessions()
-        suspicious_users = get_suspicious_users(users, sessions)
-        for u in suspicious_users:
-            reset_user_credentials(u)
-            print(f"Reset suspicious user {u['name']}")
+        users = fetch_suspicious_users()
     elif inactive:
-        inactive_users = get_inactive_users(users)
-        for u in inactive_users:
+        users = fetch_inactive_users(inactive_days, inactive_source)
+    else:
+        click.echo("Please specify a user, --suspicious, or --inactive option.")
+        return
+    if dry_run:
+        for u in users:
+            print(f"-- Reset credentials for {user_label(u)}")
+            with account_scope(u.get("account")):
+                print_batch(credential_reset_steps(u))
+    elif user and not batch:
+        for u in users:
             reset_user_credentials(u)
-            print(f"Reset inactive user {u['name']}")
+            print(f"Reset user {u['name']}")
+    else:
+        reset_users_concurrently(users, concurrency, retries, batch)
+
+
+@cli.group()
+@click.option(
+    "--db",
+    type=click.Path(dir_okay=False),
+    help="History database [default: ~/.titan/history.db]",
+)
+@click.pass_context
+def history(ctx, db):
+    """Query the local session history"""
+    ctx.obj = db
+
+
+@history.command(name="record")
+@click.pass_obj
+def record_history(db):
+    """Record a snapshot of the current sessions"""
+    count = open_history(db).record(fetch_sessions())
+    print(f"Recorded {count} sessions")
+
+
+@history.command(name="search")
+@click.option("--user", type=str, help="Filter by user name")
+@click.option("--ip", type=str, help="Filter by client IP address")
+@click.option("--since", type=click.DateTime(), help="Sessions started at or after")
+@click.option("--until", type=click.DateTime(), help="Sessions started before")
+@click.option("--limit", default=100, type=int, help="Maximum number of sessions")
+@click.pass_obj
+def search_history(db, user, ip, since, until, limit):
+    """Search recorded sessions"""
+    rows = open_history(db).search(user, ip, since, until, limit)
+    print(
+        tabulate(
+            [
+                [
+                    row["account"],
+                    row["userName"],
+                    row["id"],
+                    time_ago(row["startTime"]) if row["startTime"] else "",
+                    row["clientApplication"],
+                    row["clientNetAddress"],
+                    row["authnMethod"],
+                    format_timestamp(row["firstSeen"]),
+                    format_timestamp(row["lastSeen"]),
+                ]
+                for row in rows
+            ],
+            headers=[
+                "account",
+                "userName",
+                "id",
+                "startTime",
+                "clientApplication",
+                "clientNetAddress",
+                "authnMethod",
+                "firstSeen",
+                "lastSeen",
+            ],
+        )
+    )
+
+
+@history.command(name="ip")
+@click.argument("ip")
+@click.pass_obj
+def ip_history(db, ip):
+    """Show when an IP address was first and last seen, and by whom"""
+    rows = open_history(db).ip_summary(ip)
+    if not rows:
+        print(f"{ip} has not been seen")
+        return
+    print(
+        tabulate(
+            [
+                [
+                    row["userName"],
+                    row["account"],
+                    row["sessions"],
+                    format_timestamp(row["firstSeen"]),
+                    format_timestamp(row["lastSeen"]),
+                ]
+                for row in rows
+            ],
+            headers=["userName", "account", "sessions", "firstSeen", "lastSeen"],
+        )
+    )
+
+
+@history.command(name="compact")
+@click.option(
+    "--retention-days", default=90, type=int, help="Delete sessions not seen since"
+)
+@click.pass_obj
+def compact_history(db, retention_days):
+    """Delete old sessions and reclaim space"""
+    deleted = open_history(db).compact(retention_days)
+    print(f"Deleted {deleted} sessions")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,272 @@
+# =============================================================================
+# Copyright (C) 2024 Titan Systems, Inc
+#
+# This script is open source and available under the MIT License.
+# You may use, distribute, and modify this code under the terms of the MIT License.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+# =============================================================================
+
+import argparse
+import contextlib
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import main  # noqa: E402
+from fake_snowflake import FakeSnowflake  # noqa: E402
+
+
+def percentiles(samples):
+    if len(samples) < 2:
+        return {p: samples[0] if samples else 0.0 for p in ("p50", "p95", "p99")}
+    cuts = statistics.quantiles(samples, n=100, method="inclusive")
+    return {"p50": cuts[49], "p95": cuts[94], "p99": cuts[98]}
+
+
+def measure(fn, repeat):
+    fn()
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        items = fn()
+        samples.append(time.perf_counter() - started)
+    return samples, items
+
+
+@contextlib.contextmanager
+def quiet():
+    clear_terminal = main.clear_terminal
+    main.clear_terminal = lambda: None
+    try:
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            yield
+    finally:
+        main.clear_terminal = clear_terminal
+
+
+def scenario_sessions_list(fake, args):
+    def run():
+        sessions = main.get_sessions()
+        main.format_sessions(sessions, display_limit=50)
+        with quiet():
+            main.dump_sessions(sessions, "csv", os.devnull)
+        return len(sessions)
+
+    return measure(run, args.repeat)
+
+
+def scenario_watch_poll(fake, args):
+    watcher = main.SessionWatcher()
+    watcher.update(main.get_sessions())
+    churn = max(len(fake.sessions) // 100, 1)
+
+    def run():
+        for id in list(fake.sessions)[:churn]:
+            fake.close_session(id)
+        for _ in range(churn):
+            fake.open_session()
+        sessions = main.get_sessions()
+        watcher.update(sessions)
+        main.format_sessions(sessions, display_limit=50)
+        return len(sessions)
+
+    return measure(run, args.repeat * 5)
+
+
+def scenario_suspicious(fake, args):
+    def run():
+        main.parse_client_environment.cache_clear()
+        sessions = main.get_sessions()
+        main.suspicious_sessions(sessions)
+        return len(sessions)
+
+    return measure(run, args.repeat)
+
+
+def scenario_kill_all(fake, args):
+    # Each kill is one round trip, so report per-kill latency rather than the
+    # wall time of the whole run.
+    sessions = main.get_sessions()[: args.kill_limit]
+    # End every tenth session first: its abort returns NULL and must be
+    # reported as failed, not killed.
+    for session in sessions[::10]:
+        fake.close_session(session["id"])
+    open_before = len(fake.sessions)
+    samples = []
+    results = []
+    kill_session_by_id = main.kill_session_by_id
+
+    def timed_kill(id):
+        started = time.perf_counter()
+        try:
+            result = kill_session_by_id(id)
+            results.append(result)
+            return result
+        finally:
+            samples.append(time.perf_counter() - started)
+
+    main.kill_session_by_id = timed_kill
+    try:
+        with quiet():
+            main.kill_sessions_interactive(
+                sessions, concurrency=args.concurrency, rate=None
+            )
+    finally:
+        main.kill_session_by_id = kill_session_by_id
+    killed = open_before - len(fake.sessions)
+    if sum(results) != killed:
+        raise RuntimeError(
+            f"kill-all reported {sum(results)} kills, but {killed} sessions ended"
+        )
+    return samples, 1
+
+
+def scenario_users_reset(fake, args):
+    # Report per-request latency: one statement, or one batch with --batch.
+    samples = []
+    name = "execute_multi" if args.batch else "execute_with_retry"
+    request = getattr(main, name)
+
+    def timed_request(*a, **kw):
+        started = time.perf_counter()
+        try:
+            return request(*a, **kw)
+        finally:
+            samples.append(time.perf_counter() - started)
+
+    users = main.query_inactive_users(90)[: args.reset_limit]
+    setattr(main, name, timed_request)
+    try:
+        with quiet():
+            main.reset_users_concurrently(
+                users, concurrency=args.concurrency, batch=args.batch
+            )
+    finally:
+        setattr(main, name, request)
+    return samples, 1
+
+
+SCENARIOS = {
+    "sessions-list": scenario_sessions_list,
+    "watch-poll": scenario_watch_poll,
+    "suspicious": scenario_suspicious,
+    "kill-all": scenario_kill_all,
+    "users-reset": scenario_users_reset,
+}
+
+
+def run_scenario(name, size, args):
+    fake = FakeSnowflake(
+        sessions=size,
+        users=max(size // 10, 10),
+        latency=args.latency,
+        login_latency=args.login_latency,
+        seed=args.seed,
+    ).install(main, args.concurrency)
+    started = time.perf_counter()
+    samples, items = SCENARIOS[name](fake, args)
+    elapsed = time.perf_counter() - started
+    result = {
+        "scenario": name,
+        "sessions": size,
+        "items": items * len(samples),
+        "seconds": elapsed,
+        "throughput": items * len(samples) / elapsed,
+        "queries": fake.queries,
+        "logins": fake.logins,
+        **percentiles(samples),
+    }
+    main.configure_pool(args.concurrency)
+    return result
+
+
+def print_result(result):
+    print(
+        f"{result['scenario']:<14} {result['sessions']:>7} sessions  "
+        f"{result['throughput']:>10.0f} items/s  "
+        f"p50 {result['p50'] * 1000:8.2f} ms  "
+        f"p95 {result['p95'] * 1000:8.2f} ms  "
+        f"p99 {result['p99'] * 1000:8.2f} ms  "
+        f"{result['queries']} queries, {result['logins']} logins"
+    )
+
+
+def compare(results, baseline_path, tolerance):
+    with open(baseline_path) as f:
+        baseline = {(r["scenario"], r["sessions"]): r for r in json.load(f)}
+    regressions = []
+    for result in results:
+        previous = baseline.get((result["scenario"], result["sessions"]))
+        if previous and result["p95"] > previous["p95"] * (1 + tolerance):
+            regressions.append(
+                f"{result['scenario']} at {result['sessions']} sessions: "
+                f"p95 {previous['p95'] * 1000:.2f} ms -> {result['p95'] * 1000:.2f} ms"
+            )
+    for regression in regressions:
+        print(f"REGRESSION {regression}", file=sys.stderr)
+    return not regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark titan-security-tools against a local Snowflake stand-in"
+    )
+    parser.add_argument(
+        "--scenario", choices=list(SCENARIOS), nargs="+", default=list(SCENARIOS)
+    )
+    parser.add_argument(
+        "--sessions", type=int, nargs="+", default=[1000, 10000, 100000]
+    )
+    parser.add_argument(
+        "--latency", type=float, default=0.001, help="Seconds per query"
+    )
+    parser.add_argument("--login-latency", type=float, default=0.05)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--kill-limit", type=int, default=5000)
+    parser.add_argument("--reset-limit", type=int, default=200)
+    parser.add_argument(
+        "--batch", action="store_true", help="Reset users with batched SQL"
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="Write results to this file")
+    parser.add_argument(
+        "--baseline", help="Fail if p95 regresses against this results file"
+    )
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args()
+
+    os.environ.setdefault("TITAN_STATE_DIR", tempfile.mkdtemp(prefix="titan-bench-"))
+    main.get_ip_matcher()
+    results = []
+    for size in args.sessions:
+        for name in args.scenario:
+            results.append(run_scenario(name, size, args))
+            print_result(results[-1])
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.baseline and not compare(results, args.baseline, args.tolerance):
+        sys.exit(1)
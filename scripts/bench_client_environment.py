@@ -0,0 +1,110 @@
+# =============================================================================
+# Copyright (C) 2024 Titan Systems, Inc
+#
+# This script is open source and available under the MIT License.
+# You may use, distribute, and modify this code under the terms of the MIT License.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+# =============================================================================
+
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import main  # noqa: E402
+
+
+def legacy_matches_blocklist(client_environment, rules):
+    environment = json.loads(client_environment)
+    for rule in rules:
+        if all(environment.get(k) == v for k, v in rule.items()):
+            return True
+    return False
+
+
+def generate_rules(count):
+    rules = list(main.CLIENT_ENVIRONMENT_BLOCKLIST)
+    for i in range(count - len(rules)):
+        rule = {"APPLICATION": f"app_{i}"}
+        if i % 3 == 0:
+            rule["OS"] = random.choice(["Windows Server 2022", "Linux", "Mac OS X"])
+        rules.append(rule)
+    return rules
+
+
+def generate_sessions(count, distinct_environments):
+    environments = [
+        json.dumps(
+            {
+                "APPLICATION": f"app_{random.randrange(distinct_environments * 4)}",
+                "OS": random.choice(["Windows Server 2022", "Linux", "Mac OS X"]),
+                "OS_VERSION": f"{random.randrange(10)}.{random.randrange(10)}",
+            }
+        )
+        for _ in range(distinct_environments)
+    ]
+    return [random.choice(environments) for _ in range(count)]
+
+
+def timed(fn):
+    started = time.perf_counter()
+    result = fn()
+    return time.perf_counter() - started, result
+
+
+def bench(sessions, rules):
+    legacy_time, legacy_hits = timed(
+        lambda: sum(legacy_matches_blocklist(env, rules) for env in sessions)
+    )
+    main.parse_client_environment.cache_clear()
+    engine = main.ClientEnvironmentRules(rules)
+    engine_time, engine_hits = timed(
+        lambda: sum(
+            engine.matches(main.parse_client_environment(env)) for env in sessions
+        )
+    )
+    assert legacy_hits == engine_hits, (legacy_hits, engine_hits)
+    print(
+        f"{len(sessions):>8} sessions {len(rules):>6} rules  "
+        f"legacy {legacy_time * 1000:9.1f} ms  "
+        f"engine {engine_time * 1000:9.1f} ms  "
+        f"speedup {legacy_time / engine_time:6.1f}x  hits {engine_hits}"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Compare the client environment rule engine to a linear scan"
+    )
+    parser.add_argument("--sessions", type=int, nargs="+", default=[1000, 10000])
+    parser.add_argument("--rules", type=int, nargs="+", default=[10, 1000, 5000])
+    parser.add_argument("--distinct-environments", type=int, default=500)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    for rule_count in args.rules:
+        rules = generate_rules(rule_count)
+        for session_count in args.sessions:
+            bench(generate_sessions(session_count, args.distinct_environments), rules)
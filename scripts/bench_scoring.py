@@ -0,0 +1,107 @@
+# =============================================================================
+# Copyright (C) 2024 Titan Systems, Inc
+#
+# This script is open source and available under the MIT License.
+# You may use, distribute, and modify this code under the terms of the MIT License.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+# =============================================================================
+
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import main  # noqa: E402
+
+APPLICATIONS = ["SnowSQL", "PythonConnector", "JDBC", "DBeaver_DBeaverUltimate"]
+
+
+def generate_sessions(count, suspicious_ratio=0.01):
+    addresses = [
+        f"10.{random.randrange(256)}.{random.randrange(256)}.{random.randrange(256)}"
+        for _ in range(max(count // 20, 1))
+    ]
+    environments = [
+        json.dumps({"APPLICATION": app, "OS": os_name})
+        for app in APPLICATIONS
+        for os_name in ["Linux", "Mac OS X", "Windows Server 2022"]
+    ]
+    sessions = []
+    for i in range(count):
+        suspicious = random.random() < suspicious_ratio
+        sessions.append(
+            {
+                "id": i,
+                "userName": f"user_{random.randrange(count // 10 + 1)}",
+                "clientNetAddress": (
+                    random.choice(main.IP_BLOCKLIST)
+                    if suspicious
+                    else random.choice(addresses)
+                ),
+                "clientEnvironment": random.choice(environments),
+            }
+        )
+    return sessions
+
+
+def timed(fn, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        main.parse_client_environment.cache_clear()
+        started = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - started)
+    return best, result
+
+
+def bench(count, repeat):
+    sessions = generate_sessions(count)
+    row_time, row_hits = timed(
+        lambda: [main.session_is_suspicious(session) for session in sessions], repeat
+    )
+    batch_time, batch = timed(lambda: main.score_sessions(sessions), repeat)
+    batch_hits = [score >= main.SUSPICIOUS_SCORE for score in batch[0]]
+    assert list(batch_hits) == row_hits
+    print(
+        f"{count:>8} sessions  per-row {row_time * 1000:9.1f} ms  "
+        f"batch {batch_time * 1000:9.1f} ms  "
+        f"speedup {row_time / batch_time:5.1f}x  suspicious {sum(row_hits)}"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Compare batch session scoring to per-row session_is_suspicious"
+    )
+    parser.add_argument(
+        "--sessions", type=int, nargs="+", default=[1000, 10000, 100000]
+    )
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    main.get_ip_matcher()
+    for count in args.sessions:
+        bench(count, args.repeat)
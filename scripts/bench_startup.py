@@ -0,0 +1,111 @@
+# =============================================================================
+# Copyright (C) 2024 Titan Systems, Inc
+#
+# This script is open source and available under the MIT License.
+# You may use, distribute, and modify this code under the terms of the MIT License.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+# =============================================================================
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+COMMANDS = [
+    ["--help"],
+    ["sessions", "--help"],
+    ["users", "reset", "--help"],
+    ["hunt", "--help"],
+]
+
+# Modules that only commands talking to Snowflake or printing tables may load.
+HEAVY_MODULES = ["snowflake.connector", "tabulate", "pyarrow", "numpy"]
+
+CHECK_IMPORTS = """
+import sys
+import main
+try:
+    main.cli({args!r}, standalone_mode=False)
+except SystemExit:
+    pass
+print("heavy:" + ",".join(m for m in {modules!r} if m in sys.modules))
+"""
+
+
+def run(args):
+    started = time.perf_counter()
+    subprocess.run(
+        [sys.executable, *args],
+        cwd=ROOT,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+        check=True,
+    )
+    return time.perf_counter() - started
+
+
+def heavy_imports(args):
+    script = CHECK_IMPORTS.format(args=args, modules=HEAVY_MODULES)
+    result = subprocess.run(
+        [sys.executable, "-c", script],
+        cwd=ROOT,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    line = result.stdout.rsplit("heavy:", 1)[-1].strip()
+    return [module for module in line.split(",") if module]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Measure CLI startup time and fail if it exceeds a budget"
+    )
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument(
+        "--budget",
+        type=float,
+        default=100,
+        help="Maximum median milliseconds for each command, on top of bare interpreter startup",
+    )
+    args = parser.parse_args()
+
+    baseline = statistics.median(run(["-c", "pass"]) for _ in range(args.repeat))
+    print(f"{'python -c pass':<36} {baseline * 1000:7.1f} ms")
+    failed = False
+    for command in COMMANDS:
+        median = statistics.median(
+            run(["-m", "main", *command]) for _ in range(args.repeat)
+        )
+        cost = (median - baseline) * 1000
+        heavy = heavy_imports(command)
+        status = "ok"
+        if cost > args.budget:
+            status = f"OVER BUDGET ({args.budget:.0f} ms)"
+        if heavy:
+            status = f"imports {', '.join(heavy)}"
+        failed |= status != "ok"
+        label = " ".join(["python -m main", *command])
+        print(f"{label:<36} {median * 1000:7.1f} ms  (+{cost:.1f} ms)  {status}")
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,275 @@
+# =============================================================================
+# Copyright (C) 2024 Titan Systems, Inc
+#
+# This script is open source and available under the MIT License.
+# You may use, distribute, and modify this code under the terms of the MIT License.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+# =============================================================================
+
+"""In-process stand-in for the Snowflake connector, used by the benchmarks and
+the load generator to run main.py without a Snowflake account."""
+
+import json
+import os
+import random
+import re
+import threading
+import time
+
+from datetime import datetime, timedelta, timezone
+
+APPLICATIONS = [
+    ("SnowSQL", "Linux"),
+    ("PythonConnector", "Linux"),
+    ("JDBC", "Mac OS X"),
+    ("DBeaver_DBeaverUltimate", "Windows 11"),
+    ("DBeaver_DBeaverUltimate", "Windows Server 2022"),
+]
+
+ABORT_SESSION = re.compile(r"SYSTEM\$ABORT_SESSION\((\d+)\)", re.I)
+
+
+class FakeSnowflake:
+    def __init__(
+        self,
+        sessions=1000,
+        users=1000,
+        integrations=5,
+        latency=0.001,
+        login_latency=0.05,
+        suspicious_ratio=0.01,
+        inactive_ratio=0.05,
+        blocklist=("104.223.91.28",),
+        seed=0,
+    ):
+        self.latency = latency
+        self.login_latency = login_latency
+        self.suspicious_ratio = suspicious_ratio
+        self.blocklist = list(blocklist)
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.logins = 0
+        self.queries = 0
+        self.next_id = 1
+        self.sessions = {}
+        now = datetime.now(timezone.utc)
+        self.users = [
+            {
+                "name": f"USER_{i}",
+                "login_name": f"USER_{i}",
+                "email": f"user_{i}@example.com",
+                "disabled": "false",
+                "has_password": "true",
+                "has_rsa_public_key": "false",
+                "created_on": now - timedelta(days=400),
+                "last_success_login": (
+                    None
+                    if self.random.random() < inactive_ratio
+                    else now - timedelta(days=self.random.randrange(30))
+                ),
+            }
+            for i in range(users)
+        ]
+        self.integrations = [{"name": f"INTEGRATION_{i}"} for i in range(integrations)]
+        for _ in range(sessions):
+            self.open_session()
+
+    def open_session(self, user=None, application=None, address=None, os_name=None):
+        suspicious = self.random.random() < self.suspicious_ratio
+        app, default_os = self.random.choice(APPLICATIONS)
+        os_name = os_name or default_os
+        with self.lock:
+            id = self.next_id
+            self.next_id += 1
+            self.sessions[id] = {
+                "id": id,
+                "idAsString": str(id),
+                "userName": user or self.random.choice(self.users)["name"],
+                "isActive": True,
+                "startTime": int(time.time() * 1000),
+                "endTime": None,
+                "clientEnvironment": json.dumps(
+                    {"APPLICATION": application or app, "OS": os_name}
+                ),
+                "clientApplication": f"{application or app} 1.0.0",
+                "clientNetAddress": address
+                or (
+                    self.random.choice(self.blocklist)
+                    if suspicious
+                    else f"10.{self.random.randrange(256)}.{self.random.randrange(256)}.{self.random.randrange(256)}"
+                ),
+                "accountName": "FAKE",
+                "authnMethod": "PASSWORD",
+            }
+        return id
+
+    def close_session(self, id):
+        with self.lock:
+            return self.sessions.pop(id, None) is not None
+
+    def connect(self, account=None, **kwargs):
+        time.sleep(self.login_latency)
+        with self.lock:
+            self.logins += 1
+        return FakeConnection(self)
+
+    def connect_as(self, user=None, application=None, address=None, os_name=None):
+        # A connection that owns its own session, so aborting the session breaks
+        # the connection the way it does against Snowflake.
+        time.sleep(self.login_latency)
+        with self.lock:
+            self.logins += 1
+        return FakeConnection(
+            self, self.open_session(user, application, address, os_name)
+        )
+
+    def install(self, main, pool_size=None):
+        for name in ["ACCOUNT", "USER", "PASSWORD", "ROLE"]:
+            os.environ.setdefault(f"SNOWFLAKE_{name}", "fake")
+        main.connect = self.connect
+        main.configure_pool(
+            pool_size or int(main.os.environ.get("SNOWFLAKE_POOL_SIZE", 4))
+        )
+        return self
+
+    def run(self, sql, params=None):
+        time.sleep(self.latency)
+        with self.lock:
+            self.queries += 1
+        statement = sql.strip().rstrip(";").strip()
+        upper = statement.upper()
+        match = ABORT_SESSION.search(statement)
+        if match:
+            closed = self.close_session(int(match.group(1)))
+            return [{match.group(0): "aborted" if closed else None}]
+        if upper == "SHOW USERS":
+            return [dict(user) for user in self.users]
+        if upper == "SHOW SECURITY INTEGRATIONS":
+            return [dict(integration) for integration in self.integrations]
+        if "RESULT_SCAN" in upper or "ACCOUNT_USAGE.USERS" in upper:
+            cutoff = datetime.now(timezone.utc) - timedelta(days=params["days"])
+            return [
+                dict(user)
+                for user in self.users
+                if user["last_success_login"] is None
+                or user["last_success_login"] < cutoff
+            ]
+        if upper.startswith("ALTER USER") and "SET DISABLED = TRUE" in upper:
+            name = statement.split()[2]
+            for user in self.users:
+                if user["name"] == name:
+                    user["disabled"] = "true"
+        if upper.startswith(("ALTER", "SELECT", "CALL")):
+            return [{"status": "Statement executed successfully."}]
+        raise NotImplementedError(f"Fake Snowflake cannot run: {statement}")
+
+
+class SessionAborted(Exception):
+    errno = 390111
+
+
+class FakeRest:
+    def __init__(self, server):
+        self.server = server
+
+    def request(self, url, method="get", client="rest", **kwargs):
+        time.sleep(self.server.latency)
+        with self.server.lock:
+            self.server.queries += 1
+        if url != "/monitoring/sessions":
+            return {"success": False, "message": f"Unknown url {url}"}
+        with self.server.lock:
+            sessions = [dict(session) for session in self.server.sessions.values()]
+        return {"success": True, "data": {"sessions": sessions}}
+
+
+class FakeConnection:
+    def __init__(self, server, session_id=None):
+        self.server = server
+        self.session_id = session_id
+        self.rest = FakeRest(server)
+        self.expired = False
+        self._closed = False
+
+    def cursor(self, cursor_class=None):
+        return FakeCursor(self)
+
+    def is_closed(self):
+        return self._closed
+
+    def is_valid(self):
+        return not self._closed
+
+    def close(self):
+        self._closed = True
+        if self.session_id is not None:
+            self.server.close_session(self.session_id)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class FakeCursor:
+    def __init__(self, connection):
+        self.connection = connection
+        self.server = connection.server
+        self._results = []
+        self._rows = []
+
+    def execute(self, sql, params=None, num_statements=None):
+        id = self.connection.session_id
+        if id is not None and id not in self.server.sessions:
+            raise SessionAborted(f"Session {id} no longer exists")
+        statements = [sql]
+        if num_statements:
+            statements = [s for s in sql.split(";\n") if s.strip()]
+        self._results = [self.server.run(s, params) for s in statements]
+        self._rows = self._results.pop(0)
+        return self
+
+    def fetchall(self):
+        rows, self._rows = self._rows, []
+        return rows
+
+    def fetchmany(self, size=1):
+        rows, self._rows = self._rows[:size], self._rows[size:]
+        return rows
+
+    def fetchone(self):
+        rows = self.fetchmany(1)
+        return rows[0] if rows else None
+
+    def nextset(self):
+        if not self._results:
+            return None
+        self._rows = self._results.pop(0)
+        return self
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
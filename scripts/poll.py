@@ -23,30 +23,210 @@
 # SOFTWARE.
 # =============================================================================
 
+import argparse
 import os
+import random
+import statistics
+import sys
+import threading
+import time
 
-import snowflake.connector
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 
+# Errors a session sees once it has been aborted: query cancelled, session no
+# longer exists, session gone.
+KILLED_ERRNOS = {604, 390111, 390112}
 
-def connect():
+
+def connect(application):
+    import snowflake.connector
+
+    if os.environ.get("SNOWFLAKE_PRIVATE_KEY_FILE"):
+        credentials = dict(
+            private_key_file=os.environ["SNOWFLAKE_PRIVATE_KEY_FILE"],
+            private_key_file_pwd=os.environ.get("SNOWFLAKE_PRIVATE_KEY_FILE_PWD"),
+        )
+    else:
+        credentials = dict(password=os.environ["SNOWFLAKE_PASSWORD"])
+    # Every simulated session logs in on purpose, so cached sessions are not
+    # reused here.
     return snowflake.connector.connect(
         account=os.environ["SNOWFLAKE_ACCOUNT"],
         user=os.environ["SNOWFLAKE_USER"],
-        password=os.environ["SNOWFLAKE_PASSWORD"],
         role=os.environ["SNOWFLAKE_ROLE"],
         warehouse=os.environ["SNOWFLAKE_WAREHOUSE"],
-        application=os.environ["SNOWFLAKE_APPLICATION"],
+        application=application,
+        **credentials,
+    )
+
+
+def run_session(index, args, fake=None):
+    application = args.application[index % len(args.application)]
+    lifetime = random.uniform(*args.lifetime)
+    record = {"application": application, "queries": [], "ended": "expired"}
+    time.sleep(args.ramp * index / args.sessions)
+    started = time.perf_counter()
+    if fake:
+        conn = fake.connect_as(
+            application=application, address=args.address, os_name=args.os
+        )
+    else:
+        conn = connect(application)
+    record["connected"] = time.perf_counter()
+    record["connect"] = record["connected"] - started
+    interval = 1 / args.rate if args.rate else 0
+    try:
+        with conn.cursor() as cur:
+            while time.perf_counter() - record["connected"] < lifetime:
+                query_started = time.perf_counter()
+                try:
+                    cur.execute(args.query)
+                except Exception as err:
+                    killed = getattr(err, "errno", None) in KILLED_ERRNOS
+                    record["ended"] = "killed" if killed else "failed"
+                    record["error"] = str(err)
+                    break
+                record["queries"].append(time.perf_counter() - query_started)
+                time.sleep(max(interval - (time.perf_counter() - query_started), 0))
+    finally:
+        record["finished"] = time.perf_counter()
+        try:
+            conn.close()
+        except Exception:
+            pass
+    return record
+
+
+def run_sessions(indexes, args, fake=None):
+    with ThreadPoolExecutor(max_workers=len(indexes)) as executor:
+        return list(executor.map(lambda i: run_session(i, args, fake), indexes))
+
+
+def run_process(indexes, args):
+    return run_sessions(indexes, args)
+
+
+def percentiles(samples):
+    if len(samples) < 2:
+        return samples * 3 or [0.0] * 3
+    cuts = statistics.quantiles(samples, n=100, method="inclusive")
+    return [cuts[49], cuts[94], cuts[98]]
+
+
+def format_percentiles(label, samples):
+    p50, p95, p99 = (value * 1000 for value in percentiles(samples))
+    return f"{label:<10} p50 {p50:8.1f} ms  p95 {p95:8.1f} ms  p99 {p99:8.1f} ms"
+
+
+def summarize(records, kill_started=None):
+    queries = [latency for record in records for latency in record["queries"]]
+    killed = [record for record in records if record["ended"] == "killed"]
+    failed = [record for record in records if record["ended"] == "failed"]
+    print(
+        f"\n{len(records)} sessions, {len(queries)} queries, "
+        f"{len(killed)} killed, {len(failed)} failed"
     )
+    for error in sorted({record["error"] for record in failed})[:5]:
+        print(f"  {error}")
+    print(format_percentiles("connect", [record["connect"] for record in records]))
+    print(format_percentiles("query", queries))
+    if killed:
+        first = kill_started or min(record["finished"] for record in killed)
+        last = max(record["finished"] for record in killed)
+        print(f"cleared    {len(killed)} sessions in {last - first:.2f}s")
+
+
+def kill_suspicious(fake, delay):
+    # Drive the real kill path against the stand-in once the flood is connected.
+    sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+    import main
+
+    fake.install(main)
+    time.sleep(delay)
+    started = time.perf_counter()
+    sessions = main.suspicious_sessions(main.get_sessions())
+    main.kill_sessions_interactive(sessions, rate=None)
+    return started
 
 
-def poll():
-    conn = connect()
-    with conn.cursor() as cur:
-        for i in range(500):
-            cur.execute("CALL SYSTEM$WAIT(1)")
-            print("•" if i % 10 == 0 else ".", end="", flush=True)
-    conn.close()
+def generate_load(args):
+    indexes = list(range(args.sessions))
+    if args.fake:
+        from fake_snowflake import FakeSnowflake
+
+        fake = FakeSnowflake(
+            sessions=0, latency=args.fake_latency, login_latency=args.fake_latency
+        )
+        kill_started = None
+        with ThreadPoolExecutor(max_workers=1) as killer:
+            if args.kill_after is not None:
+                kill = killer.submit(kill_suspicious, fake, args.kill_after)
+            records = run_sessions(indexes, args, fake)
+            if args.kill_after is not None:
+                kill_started = kill.result()
+        return records, kill_started
+    if args.processes > 1:
+        chunks = [indexes[i :: args.processes] for i in range(args.processes)]
+        with ProcessPoolExecutor(max_workers=args.processes) as executor:
+            results = executor.map(run_process, chunks, [args] * len(chunks))
+            return [record for chunk in results for record in chunk], None
+    return run_sessions(indexes, args), None
 
 
 if __name__ == "__main__":
-    poll()
+    parser = argparse.ArgumentParser(
+        description="Open many concurrent Snowflake sessions to rehearse detection and response"
+    )
+    parser.add_argument("--sessions", type=int, default=1, help="Concurrent sessions")
+    parser.add_argument(
+        "--application",
+        action="append",
+        help="Client application name; repeat to mix several (default: $SNOWFLAKE_APPLICATION)",
+    )
+    parser.add_argument(
+        "--lifetime",
+        type=float,
+        nargs=2,
+        default=[500.0, 500.0],
+        metavar=("MIN", "MAX"),
+        help="Seconds each session stays connected",
+    )
+    parser.add_argument(
+        "--rate", type=float, default=1.0, help="Queries per second per session"
+    )
+    parser.add_argument("--query", default="CALL SYSTEM$WAIT(1)")
+    parser.add_argument(
+        "--ramp", type=float, default=0.0, help="Seconds over which to open sessions"
+    )
+    parser.add_argument(
+        "--processes",
+        type=int,
+        default=1,
+        help="Spread sessions over this many processes",
+    )
+    parser.add_argument(
+        "--fake", action="store_true", help="Target the local Snowflake stand-in"
+    )
+    parser.add_argument("--fake-latency", type=float, default=0.001)
+    parser.add_argument("--address", help="Client IP for fake sessions")
+    parser.add_argument("--os", help="Client OS for fake sessions")
+    parser.add_argument(
+        "--kill-after",
+        type=float,
+        help="With --fake, kill suspicious sessions this many seconds after starting",
+    )
+    args = parser.parse_args()
+    args.application = args.application or [
+        os.environ.get("SNOWFLAKE_APPLICATION", "titan-poll")
+    ]
+    if args.fake and args.processes > 1:
+        parser.error("--fake runs in-process and cannot be combined with --processes")
+    if args.kill_after is not None and not args.fake:
+        parser.error(
+            "--kill-after needs --fake; run `sessions kill --suspicious` instead"
+        )
+
+    random.seed(0)
+    threading.stack_size(256 * 1024)
+    records, kill_started = generate_load(args)
+    summarize(records, kill_started)